@@ -1,3 +1,4 @@
+import bpy
 from bpy_extras.io_utils import (
     ImportHelper,
     ExportHelper,
@@ -8,6 +9,7 @@ from bpy_extras.io_utils import (
 
 from bpy.props import (
     BoolProperty,
+    CollectionProperty,
     EnumProperty,
     StringProperty,
     IntProperty,
@@ -15,7 +17,6 @@ from bpy.props import (
 )
 
 
-import bpy
 bl_info = {
     "name": "Painkiller (MPK/DAT/PKMDL/ANI) format",
     "author": "dilettante",
@@ -48,6 +49,8 @@ if "bpy" in locals():
         importlib.reload(pk_import)
     if "pk_export" in locals():
         importlib.reload(pk_export)
+    if "perf" in locals():
+        importlib.reload(perf)
 
 
 class ImportMPK(bpy.types.Operator, ImportHelper):
@@ -74,6 +77,22 @@ class ImportMPK(bpy.types.Operator, ImportHelper):
             description = "Removes double vertices",
             default = True )
 
+    memory_limit: IntProperty(
+            name="Memory limit (MB)",
+            description="Objects decoded ahead of the one being built, in MB (0: unlimited)",
+            min=0,
+            default = 0 )
+
+    use_perf_report: BoolProperty(
+            name="Timing report",
+            description="Also write the per-phase timings and counters as <file>.perf.json next to the file (PK2004_PERF_REPORT sets the target)",
+            default = False )
+
+    use_profile: BoolProperty(
+            name="Profile",
+            description="Run under cProfile and write a .prof file with a per-phase summary (PK2004_PROFILE sets the target)",
+            default = False )
+
     def execute(self, context):
         from . import pk_import
 
@@ -86,6 +105,9 @@ class ImportMPK(bpy.types.Operator, ImportHelper):
         box.prop( self, 'use_lightmaps' )
         box.prop( self, 'use_blendmaps' )
         box.prop( self, 'remove_doubles' )
+        self.layout.prop( self, 'memory_limit' )
+        self.layout.prop( self, 'use_perf_report' )
+        self.layout.prop( self, 'use_profile' )
 
 
 def ensure_filepath_matches_format(filepath, fileformat):
@@ -229,6 +251,26 @@ class ExportMPK(bpy.types.Operator, ExportHelper):
         default=1.0,
     )
 
+    use_cache: BoolProperty(
+            name="Reuse unchanged",
+            description="Copy objects whose mesh, transform, materials and options did not change since an earlier export instead of converting them again",
+            default = True )
+
+    use_cache_dir: BoolProperty(
+            name="Cache on disk",
+            description="Also keep the cache in a folder next to the .blend file, for later sessions",
+            default = False )
+
+    use_perf_report: BoolProperty(
+            name="Timing report",
+            description="Also write the per-phase timings and counters as <file>.perf.json next to the file (PK2004_PERF_REPORT sets the target)",
+            default = False )
+
+    use_profile: BoolProperty(
+            name="Profile",
+            description="Run under cProfile and write a .prof file with a per-phase summary (PK2004_PROFILE sets the target)",
+            default = False )
+
     def info(self, msg='', icon=''):
         self.report({icon}, f'{self.fileformat} Export : ' + msg)
 
@@ -279,6 +321,14 @@ class ExportMPK(bpy.types.Operator, ExportHelper):
         self.layout.use_property_decorate = False
         self.layout.prop( self, 'scale_factor' )
         self.layout.prop( self, 'fileformat' )
+        self.layout.use_property_split = False
+        box4 = self.layout.box()
+        box4.prop( self, 'use_cache' )
+        col = box4.column()
+        col.enabled = self.use_cache
+        col.prop( self, 'use_cache_dir' )
+        self.layout.prop( self, 'use_perf_report' )
+        self.layout.prop( self, 'use_profile' )
 
 
 class ImportMDL(bpy.types.Operator, ImportHelper):
@@ -290,6 +340,14 @@ class ImportMDL(bpy.types.Operator, ImportHelper):
     filename_ext = ''
     filter_glob: StringProperty(default='*.pkmdl', options={'HIDDEN'})
 
+    files: CollectionProperty(
+            type=bpy.types.OperatorFileListElement,
+            options={'HIDDEN', 'SKIP_SAVE'} )
+
+    directory: StringProperty(
+            subtype='DIR_PATH',
+            options={'HIDDEN', 'SKIP_SAVE'} )
+
     fileformat: EnumProperty(
         name = 'Format',
         items = (('PKMDL', '(*.pkmdl)','Model'),('ANI','(*.ani)', 'Animation')),
@@ -302,6 +360,11 @@ class ImportMDL(bpy.types.Operator, ImportHelper):
     use_blendmaps : BoolProperty( default = False )
     remove_doubles : BoolProperty( default = False )
 
+    skin_names: StringProperty(
+            name="Skins",
+            description="Comma separated skin names to import (empty: the first skin, '*': all skins)",
+            default = '' )
+
     use_scale: BoolProperty(
             name="Use scale",
             description="Consider scaling",
@@ -312,6 +375,34 @@ class ImportMDL(bpy.types.Operator, ImportHelper):
             description="Add extra key",
             default = False )
 
+    use_reduce_keys: BoolProperty(
+            name="Reduce keys",
+            description="Only key frames that linear interpolation can't rebuild",
+            default = False )
+
+    key_tolerance: FloatProperty(
+            name="Tolerance",
+            description="Maximum channel error of a dropped key",
+            min=0.0, max=1.0,
+            precision=5,
+            default = 0.0001 )
+
+    memory_limit: IntProperty(
+            name="Memory limit (MB)",
+            description="Objects (PKMDL) or clip files (ANI) decoded ahead of the one being built, in MB (0: unlimited)",
+            min=0,
+            default = 0 )
+
+    use_perf_report: BoolProperty(
+            name="Timing report",
+            description="Also write the per-phase timings and counters as <file>.perf.json next to the file (PK2004_PERF_REPORT sets the target)",
+            default = False )
+
+    use_profile: BoolProperty(
+            name="Profile",
+            description="Run under cProfile and write a .prof file with a per-phase summary (PK2004_PROFILE sets the target)",
+            default = False )
+
     def invoke(self, context, event):
         self.filter_glob = '*.pkmdl' if self.fileformat == 'PKMDL' else '*.ani'
         context.window_manager.fileselect_add(self)
@@ -332,10 +423,21 @@ class ImportMDL(bpy.types.Operator, ImportHelper):
         self.layout.prop( self, 'fileformat' )
         self.layout.use_property_split = False
         self.layout.use_property_decorate = True
+        if self.fileformat == 'PKMDL':
+            box1 = self.layout.box()
+            box1.prop( self, 'skin_names' )
         if self.fileformat == 'ANI':
             box1 = self.layout.box()
             box1.prop( self, 'close_seq' )
             box1.prop( self, 'use_scale' )
+            box2 = self.layout.box()
+            box2.prop( self, 'use_reduce_keys' )
+            col = box2.column()
+            col.enabled = self.use_reduce_keys
+            col.prop( self, 'key_tolerance' )
+        self.layout.prop( self, 'memory_limit' )
+        self.layout.prop( self, 'use_perf_report' )
+        self.layout.prop( self, 'use_profile' )
 
 
 @orientation_helper(axis_forward='Y', axis_up='Z')
@@ -382,6 +484,64 @@ class ExportMDL(bpy.types.Operator, ExportHelper):
 
     scale_factor: FloatProperty( default=1.0 )
 
+    max_influences: IntProperty(
+            name="Max influences",
+            description="Keep the strongest influences per vertex (0 = no limit)",
+            min=0, max=16,
+            default = 4 )
+
+    weight_epsilon: FloatProperty(
+            name="Min weight",
+            description="Drop influences below this weight",
+            min=0.0, max=1.0,
+            precision=4,
+            default = 0.001 )
+
+    use_reduce_keys: BoolProperty(
+            name="Reduce keys",
+            description="Drop keys that can be interpolated from their neighbours",
+            default = False )
+
+    key_pos_tolerance: FloatProperty(
+            name="Position tolerance",
+            description="Maximum location (and scale) error of a dropped key",
+            min=0.0, max=1.0,
+            precision=4,
+            default = 0.001 )
+
+    key_rot_tolerance: FloatProperty(
+            name="Rotation tolerance",
+            description="Maximum rotation error of a dropped key",
+            subtype='ANGLE',
+            min=0.0, max=0.5,
+            precision=3,
+            default = 0.001745 )
+
+    use_all_actions: BoolProperty(
+            name="All actions",
+            description="Export every action of the armature to its own file",
+            default = False )
+
+    use_cache: BoolProperty(
+            name="Reuse unchanged",
+            description="Copy objects whose mesh, transform, materials and options did not change since an earlier export instead of converting them again",
+            default = True )
+
+    use_cache_dir: BoolProperty(
+            name="Cache on disk",
+            description="Also keep the cache in a folder next to the .blend file, for later sessions",
+            default = False )
+
+    use_perf_report: BoolProperty(
+            name="Timing report",
+            description="Also write the per-phase timings and counters as <file>.perf.json next to the file (PK2004_PERF_REPORT sets the target)",
+            default = False )
+
+    use_profile: BoolProperty(
+            name="Profile",
+            description="Run under cProfile and write a .prof file with a per-phase summary (PK2004_PROFILE sets the target)",
+            default = False )
+
     def info(self, msg='', icon=''):
         self.report({icon}, f'{self.fileformat} Export : ' + msg)
 
@@ -429,6 +589,24 @@ class ExportMDL(bpy.types.Operator, ExportHelper):
             box1.prop( self, 'use_all' )
             box1.prop( self, 'use_selection' )
             box1.prop( self, 'use_visible' )
+            box2 = self.layout.box()
+            box2.prop( self, 'max_influences' )
+            box2.prop( self, 'weight_epsilon' )
+            box3 = self.layout.box()
+            box3.prop( self, 'use_cache' )
+            col = box3.column()
+            col.enabled = self.use_cache
+            col.prop( self, 'use_cache_dir' )
+        if self.fileformat == 'ANI':
+            box1 = self.layout.box()
+            box1.prop( self, 'use_all_actions' )
+            box1.prop( self, 'use_reduce_keys' )
+            col = box1.column()
+            col.enabled = self.use_reduce_keys
+            col.prop( self, 'key_pos_tolerance' )
+            col.prop( self, 'key_rot_tolerance' )
+        self.layout.prop( self, 'use_perf_report' )
+        self.layout.prop( self, 'use_profile' )
 
 
 # Add to a menu
@@ -468,6 +646,8 @@ def unregister():
     bpy.types.TOPBAR_MT_file_import.remove(menu_func_import_mdl)
     bpy.utils.unregister_class(ExportMDL)
     bpy.types.TOPBAR_MT_file_export.remove(menu_func_export_mdl)
+    from . import common
+    common.ShutdownPool()
 
 
 if __name__ == "__main__":
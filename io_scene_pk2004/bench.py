@@ -0,0 +1,547 @@
+import argparse
+import gc
+import json
+import math
+import platform
+import subprocess
+import sys
+import tempfile
+import tracemalloc
+from contextlib import contextmanager
+from .common import *
+from .mpkimp import CacheMPK, load_mpk
+from .datimp import CacheMeshDAT, load_dat
+from .mpkexp import writeMPK
+from .datexp import dumpDAT
+from .mdlimp import BuildSkeleton, SetWeights
+from . import bl_info
+from . import common
+
+
+# benchmarks over synthetic assets, run with the bpy module (pip install bpy)
+# or headless blender:
+#
+#   blender -b --factory-startup --python-expr "import sys; from io_scene_pk2004 import bench; sys.exit(bench.main(['run']))"
+#
+#   python -m io_scene_pk2004.bench memory [--sizes 1000,8000,32000] [--objects 4] [--json out.json]
+#   python -m io_scene_pk2004.bench run [--store bench.json]
+#   python -m io_scene_pk2004.bench compare BASELINE [--store bench.json]
+#
+# 'memory' traces every parser/writer phase with tracemalloc and reports the
+# peak and the retained (still referenced after the phase) python heap, also
+# per vertex. Blender-side allocations (bpy.data) are not seen by tracemalloc.
+#
+# 'run' times the hot paths (repeated, median and MAD) and stores the results
+# in a JSON file keyed by machine and git commit. 'compare' reruns them (or
+# takes a stored commit with --against) and checks every median against the
+# baseline commit: a slowdown beyond both the relative tolerance and the noise
+# band (sigma * MAD) is a regression and the exit status becomes 1.
+#
+# The Blender-side paths (load_mpk, load_dat, BuildGeometry, BuildUVs,
+# BuildMaterials, BuildMesh, BuildSkeleton, SetWeights, getGeometry,
+# getMaterial, ConvertToMPKFaces) run
+# on the real bpy in background mode; a background run starts from factory
+# settings so the numbers don't depend on the startup file. Everything a
+# benchmark creates in bpy.data is removed again, still: run it headless, not
+# in a session with work in it.
+
+
+SIZES = (1000, 8000, 32000) # the largest still fits the 16 bit MPK face runs
+OBJECTS = 4
+SIZE = 4000     # vertices per object for 'run'
+REPEAT = 5
+STORE = 'pk2004_bench.json'
+TOLERANCE = 0.10
+SIGMA = 3.0
+
+
+def grid(name, numverts, numUVs=2):
+    # MeshOut of a flat square grid with ~numverts vertices, as getGeometry makes it
+    side = max(2, math.isqrt(numverts))
+    y, x = np.mgrid[0:side, 0:side].astype(np.float32)
+    u, v = x / (side - 1), y / (side - 1)
+    verts = np.zeros(side * side, dtype=VERTEX)
+    verts['pos'] = np.stack((x, np.zeros_like(x), -y), axis=-1).reshape(-1, 3)
+    verts['normal'] = (0, 1, 0)
+    verts['uv0'] = verts['uv1'] = np.stack((u, 1 - v), axis=-1).reshape(-1, 2)
+    quads = (np.arange(side - 1)[:, None] * side + np.arange(side - 1)).ravel()
+    tris = np.concatenate((
+        np.stack((quads, quads + side, quads + 1), axis=-1),
+        np.stack((quads + 1, quads + side, quads + side + 1), axis=-1)))
+    faces = tris.astype(np.uint32)
+    bbox = struct.pack('<6f', 0, 0, -(side - 1), side - 1, 0, 0)
+    lm = ('', name + '_L_0000')[numUVs == 2]
+    mtls = np.array([[len(faces), 0]], dtype=np.uint32)
+    return MeshOut(name, bbox, numUVs, verts, faces, mtls, [getMaterial(None)], lm, 0x02)
+
+
+def scene(numverts, objects):
+    return [grid(f'bench_{i:02d}', numverts) for i in range(objects)]
+
+
+def write_mpk(filepath, geom):
+    with open(filepath, 'wb') as file:
+        writeMPK(file, geom)
+
+
+def write_dat(filepath, geom):
+    with open(filepath, 'wb') as file:
+        dumpDAT(file, geom)
+
+
+def read_mpk(filepath):
+    with open(filepath, 'rb') as file:
+        return list(CacheMPK(file))
+
+
+def read_dat(filepath):
+    with open(filepath, 'rb') as file:
+        return list(CacheMeshDAT(file))
+
+
+def stream_dat(filepath):
+    # as load_dat consumes it : one object alive at a time
+    with open(filepath, 'rb') as file:
+        for geom in CacheMeshDAT(file): pass
+
+
+FORMATS = {
+    'MPK': (write_mpk, read_mpk),
+    'DAT': (write_dat, read_dat),
+}
+
+
+def synthetic(size, tmp):
+    # MPK/DAT files of OBJECTS grids, written once per size
+    paths = {fmt: os.path.join(tmp, f'bench_{size}.{fmt.lower()}') for fmt in FORMATS}
+    if not os.path.exists(paths['DAT']):
+        geom = scene(size, OBJECTS)
+        for fmt, (write, read) in FORMATS.items(): write(paths[fmt], geom)
+    return paths
+
+
+def grid_mesh(size):
+    # triangulated bpy mesh of one grid with both UV layers
+    ob = grid('bench_mesh', size)
+    mesh = bpy.data.meshes.new(ob.name)
+    mesh.from_pydata(pk2bl(ob.verts['pos']).tolist(), [], ob.faces.tolist())
+    loops = ob.faces.ravel()
+    for name, uv in (('colormap', ob.verts['uv0']), ('lightmap', ob.verts['uv1'])):
+        mesh.uv_layers.new(name=name).data.foreach_set('uv', flipv(uv)[loops].ravel())
+    return mesh
+
+
+def grid_object(size, name='bench_mesh'):
+    ob = bpy.data.objects.new(name, grid_mesh(size))
+    bpy.context.scene.collection.objects.link(ob)
+    return ob
+
+
+def rig(numbones):
+    # skin of a binary bone tree, parents precede their children like in PKMDL
+    parents = np.arange(numbones, dtype=np.int32) - 1 >> 1
+    tms = np.tile(np.eye(4, dtype=np.float32), (numbones, 1, 1))
+    tms[1:, 3, :3] = (0.0, 0.0, 1.0)  # row vector translation, pk space
+    skel = SimpleNamespace(names=[f'bone_{i:03d}' for i in range(numbones)], parents=parents, tms=tms)
+    return SimpleNamespace(skinname='bench', skel=skel)
+
+
+def skin_weights(numverts, numbones):
+    # two influences per vertex, deterministic
+    v = np.arange(numverts)
+    first, second = v % numbones, (v * 7 + 3) % numbones
+    weight = 0.25 + 0.5 * (v % 3) / 2
+    return SimpleNamespace(
+        counts=np.full(numverts, 2, dtype=np.int32),
+        bone_idx=np.stack((first, second), axis=-1).ravel().astype(np.uint16),
+        weight=np.stack((weight, 1 - weight), axis=-1).ravel().astype(np.float32))
+
+
+def blended(geometry):
+    # switch the parsed materials to colormap + blendmap + alphamap
+    for i, geom in enumerate(geometry):
+        for j, mat in enumerate(geom.mat):
+            mat.colorMapName = f'bench_color_{i}_{j}'
+            mat.blendMapName = f'bench_blend_{i}_{j}'
+            mat.alphaMapName = f'bench_alpha_{i}_{j}'
+    return geometry
+
+
+BENCHMARKS = {}
+
+
+def benchmark(func):
+    # func(size, tmp) prepares the inputs and returns what is timed
+    BENCHMARKS[func.__name__] = func
+    return func
+
+
+@benchmark
+def mpk_parse(size, tmp):
+    filepath = synthetic(size, tmp)['MPK']
+    return lambda: read_mpk(filepath)
+
+
+@benchmark
+def dat_parse(size, tmp):
+    filepath = synthetic(size, tmp)['DAT']
+    return lambda: read_dat(filepath)
+
+
+@benchmark
+def mpk_write(size, tmp):
+    geom = scene(size, OBJECTS)
+    return lambda: write_mpk(os.path.join(tmp, 'out.mpk'), geom)
+
+
+@benchmark
+def dat_write(size, tmp):
+    geom = scene(size, OBJECTS)
+    return lambda: write_dat(os.path.join(tmp, 'out.dat'), geom)
+
+
+@benchmark
+def build_geometry(size, tmp):
+    set_glob(params=(mathutils.Matrix(), True, True, tmp))
+    geometry = read_mpk(synthetic(size, tmp)['MPK'])
+    return lambda: [BuildGeometry(geom) for geom in geometry]
+
+
+@benchmark
+def build_uvs(size, tmp):
+    set_glob(params=(mathutils.Matrix(), True, True, tmp))
+    geometry = read_mpk(synthetic(size, tmp)['MPK'])
+    meshes = [BuildGeometry(geom)[0] for geom in geometry]
+    return lambda: [BuildUVs(geom, mesh) for geom, mesh in zip(geometry, meshes)]
+
+
+@benchmark
+def build_materials(size, tmp):
+    set_glob(params=(mathutils.Matrix(), True, True, tmp))
+    geometry = blended(read_mpk(synthetic(size, tmp)['MPK']))
+    meshes = [bpy.data.meshes.new(geom.meshname) for geom in geometry]
+    return lambda: [BuildMaterials(geom, mesh) for geom, mesh in zip(geometry, meshes)]
+
+
+@benchmark
+def build_mesh(size, tmp):
+    set_glob(params=(mathutils.Matrix(), True, True, tmp))
+    geometry = read_mpk(synthetic(size, tmp)['MPK'])
+    return lambda: [BuildMesh(geom) for geom in geometry]
+
+
+def importer(load, filepath):
+    def run():
+        with open(filepath, 'rb') as file: load(file)
+    return run
+
+
+@benchmark
+def import_mpk(size, tmp):
+    # decode & build overlapped, as the operator runs it
+    set_glob(params=(mathutils.Matrix(), True, True, tmp))
+    return importer(load_mpk, synthetic(size, tmp)['MPK'])
+
+
+@benchmark
+def import_dat(size, tmp):
+    set_glob(params=(mathutils.Matrix(), True, True, tmp))
+    return importer(load_dat, synthetic(size, tmp)['DAT'])
+
+
+@benchmark
+def build_skeleton(size, tmp):
+    skin = rig(max(8, size // 50))
+    return lambda: BuildSkeleton(skin)
+
+
+@benchmark
+def set_weights(size, tmp):
+    skin = rig(max(8, size // 50))
+    arm_obj, names = BuildSkeleton(skin)
+    ob = grid_object(size)
+    weights = skin_weights(len(ob.data.vertices), len(names))
+    return lambda: SetWeights(arm_obj, names, ob, weights)
+
+
+@benchmark
+def get_geometry(size, tmp):
+    for i in range(OBJECTS): grid_object(size, f'bench_{i:02d}')
+    params = ('MPK', False, True, False, False, False, 1.0)
+    return lambda: list(getGeometry(None, bpy.context, mathutils.Matrix(), params))
+
+
+@benchmark
+def get_geometry_pool(size, tmp):
+    # get_geometry with conversions in one process per core, whatever the
+    # amount of work (the same as get_geometry on a single core)
+    for i in range(OBJECTS): grid_object(size, f'bench_{i:02d}')
+    params = ('MPK', False, True, False, False, False, 1.0)
+    def convert():
+        saved = common.workers, common.PARALLEL, common.SMALL
+        common.workers, common.PARALLEL, common.SMALL = None, 0, 0
+        try:
+            return list(getGeometry(None, bpy.context, mathutils.Matrix(), params))
+        finally:
+            common.workers, common.PARALLEL, common.SMALL = saved
+    convert() # start the processes
+    return convert
+
+
+@benchmark
+def reexport(size, tmp):
+    # an unchanged scene exported again : every object from the chunk cache
+    for i in range(OBJECTS): grid_object(size, f'bench_{i:02d}')
+    params = ('MPK', False, True, False, False, False, 1.0)
+    def export():
+        chunks.enabled = True
+        try:
+            with open(os.path.join(tmp, 'reexport.mpk'), 'wb') as file:
+                writeMPK(file, getGeometry(file, bpy.context, mathutils.Matrix(), params))
+        finally:
+            chunks.enabled = False
+    export()
+    return export
+
+
+@benchmark
+def get_material(size, tmp):
+    set_glob(params=(mathutils.Matrix(), True, True, tmp))
+    geometry = blended(read_mpk(synthetic(size, tmp)['MPK']))
+    materials = [mtl for geom in geometry for mtl in BuildMesh(geom).data.materials]
+    return lambda: [getMaterial(mtl) for mtl in materials]
+
+
+@benchmark
+def convert(size, tmp):
+    mesh = grid_mesh(size)
+    return lambda: ConvertToMPKFaces(mesh, False, False)
+
+
+@benchmark
+def convert_optimize(size, tmp):
+    mesh = grid_mesh(size)
+    return lambda: ConvertToMPKFaces(mesh, False, True)
+
+
+@contextmanager
+def scratch():
+    # drop whatever the benchmark added to bpy.data
+    kinds = ('objects', 'meshes', 'materials', 'images', 'collections', 'armatures', 'actions')
+    before = {kind: set(getattr(bpy.data, kind)) for kind in kinds}
+    try:
+        yield
+    finally:
+        added = [id for kind in kinds for id in getattr(bpy.data, kind) if id not in before[kind]]
+        if added: bpy.data.batch_remove(added)
+
+
+def stats(samples):
+    median = float(np.median(samples))
+    return {
+        'median': round(median, 6),
+        'min': round(min(samples), 6),
+        'mad': round(float(np.median(np.abs(np.array(samples) - median))), 6),
+        'samples': [round(t, 6) for t in samples],
+    }
+
+
+def run(names=None, size=SIZE, repeat=REPEAT):
+    # no chunk cache but where a benchmark asks for it : conversions are timed
+    chunks.enabled = False
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for name in names or BENCHMARKS:
+            samples = []
+            for i in range(repeat):
+                with scratch():
+                    func = BENCHMARKS[name](size, tmp)
+                    gc.collect()
+                    start = time.perf_counter()
+                    func()
+                    samples.append(time.perf_counter() - start)
+                    del func
+            results[name] = stats(samples)
+    return results
+
+
+def machine():
+    return f'{platform.node()}-{platform.machine()}'
+
+
+def commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(__file__), check=True).stdout.strip()
+    except Exception:
+        return 'unknown'
+
+
+def load_store(filepath):
+    try:
+        with open(filepath) as file: return json.load(file)
+    except FileNotFoundError:
+        return {}
+
+
+def save_store(filepath, store):
+    with open(filepath, 'w') as file:
+        json.dump(store, file, indent=1)
+
+
+def compare(base, new, tolerance=TOLERANCE, sigma=SIGMA):
+    # rows of (name, base median, new median, change, status)
+    rows = []
+    for name in base:
+        if name not in new: continue
+        b, n = base[name], new[name]
+        delta = n['median'] - b['median']
+        limit = max(tolerance * b['median'], sigma * 1.4826 * max(b['mad'], n['mad']))
+        status = 'ok'
+        if delta > limit: status = 'REGRESSED'
+        elif -delta > limit: status = 'improved'
+        rows.append((name, b['median'], n['median'], delta / b['median'] if b['median'] else 0, status))
+    return rows
+
+
+def traced(func, *args):
+    # run func, return its result with the peak/retained heap growth it caused
+    gc.collect()
+    tracemalloc.reset_peak()
+    base = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+    result = func(*args)
+    elapsed = time.perf_counter() - start
+    gc.collect()
+    current, peak = tracemalloc.get_traced_memory()
+    return result, SimpleNamespace(time=elapsed, peak=peak - base, retained=current - base)
+
+
+def memory(sizes=SIZES, objects=OBJECTS):
+    results = []
+    tracemalloc.start()
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            for size in sizes:
+                geom, m = traced(scene, size, objects)
+                numverts = sum(len(ob.verts) for ob in geom)
+                rows = [('input', m)]
+                for fmt, (write, read) in FORMATS.items():
+                    filepath = os.path.join(tmp, f'bench.{fmt.lower()}')
+                    _, m = traced(write, filepath, geom)
+                    rows.append((f'{fmt} write', m))
+                    parsed, m = traced(read, filepath)
+                    rows.append((f'{fmt} parse', m))
+                    del parsed
+                _, m = traced(stream_dat, os.path.join(tmp, 'bench.dat'))
+                rows.append(('DAT stream', m))
+                del geom
+                for phase, m in rows:
+                    results.append({
+                        'phase': phase,
+                        'objects': objects,
+                        'verts': numverts,
+                        'time': round(m.time, 6),
+                        'peak': m.peak,
+                        'retained': m.retained,
+                        'peak_per_vert': round(m.peak / numverts, 1),
+                        'retained_per_vert': round(m.retained / numverts, 1),
+                    })
+    finally:
+        tracemalloc.stop()
+    return results
+
+
+def table(results):
+    lines = [f'{"phase":<12} {"verts":>8} {"time":>8} {"peak":>12} {"retained":>12} {"peak/v":>8} {"ret/v":>8}']
+    for r in results:
+        lines.append(f'{r["phase"]:<12} {r["verts"]:>8} {r["time"]:>7.3f}s {r["peak"]:>12} {r["retained"]:>12} '
+                     f'{r["peak_per_vert"]:>8} {r["retained_per_vert"]:>8}')
+    return '\n'.join(lines)
+
+
+def timings(results):
+    lines = [f'{"benchmark":<18} {"median":>9} {"min":>9} {"mad":>9}']
+    for name, r in results.items():
+        lines.append(f'{name:<18} {r["median"]:>8.4f}s {r["min"]:>8.4f}s {r["mad"]:>8.4f}s')
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m io_scene_pk2004.bench')
+    commands = parser.add_subparsers(dest='command', required=True)
+    cmd = commands.add_parser('memory', help='peak/retained heap per parser and writer phase')
+    cmd.add_argument('--sizes', default=','.join(map(str, SIZES)), help='vertices per object, comma separated')
+    cmd.add_argument('--objects', type=int, default=OBJECTS, help='objects per file')
+    cmd.add_argument('--json', help='also write the results to this file')
+    for name in ('run', 'compare'):
+        cmd = commands.add_parser(name, help=('time the hot paths and store the results',
+                                              'time the hot paths and compare against a stored baseline')[name == 'compare'])
+        if name == 'compare':
+            cmd.add_argument('baseline', help='stored commit to compare against')
+            cmd.add_argument('--against', help='compare a stored commit instead of a fresh run')
+            cmd.add_argument('--tolerance', type=float, default=TOLERANCE, help='relative slowdown allowed')
+            cmd.add_argument('--sigma', type=float, default=SIGMA, help='noise band in MADs')
+            cmd.add_argument('--save', action='store_true', help='also store the fresh run')
+        cmd.add_argument('--store', default=STORE, help='results file')
+        cmd.add_argument('--machine', default=machine(), help='machine key')
+        cmd.add_argument('--commit', default=None, help='commit key (default: git HEAD)')
+        cmd.add_argument('--only', help='benchmarks to run, comma separated: ' + ','.join(BENCHMARKS))
+        cmd.add_argument('--size', type=int, default=SIZE, help='vertices per object')
+        cmd.add_argument('--repeat', type=int, default=REPEAT)
+    args = parser.parse_args(argv)
+
+    if bpy.app.background:
+        bpy.ops.wm.read_factory_settings(use_empty=True)
+
+    match args.command:
+        case 'memory':
+            results = memory([int(s) for s in args.sizes.split(',')], args.objects)
+            print(table(results))
+            if args.json:
+                with open(args.json, 'w') as file:
+                    json.dump(results, file, indent=1)
+            return 0
+
+    store = load_store(args.store)
+    runs = store.setdefault(args.machine, {})
+    key = args.commit or commit()
+    only = args.only.split(',') if args.only else None
+
+    def fresh(size, repeat):
+        results = run(only, size, repeat)
+        print(timings(results))
+        return {'size': size, 'repeat': repeat, 'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+                'python': platform.python_version(), 'blender': bpy.app.version_string,
+                'addon': '.'.join(map(str, bl_info['version'])), 'results': results}
+
+    match args.command:
+        case 'run':
+            runs[key] = fresh(args.size, args.repeat)
+            save_store(args.store, store)
+            print(f'stored as {args.machine} / {key} in {args.store}')
+            return 0
+        case 'compare':
+            base = runs.get(args.baseline)
+            if base is None:
+                print(f'no baseline {args.baseline} for {args.machine} in {args.store}')
+                return 2
+            if args.against:
+                new = runs.get(args.against)
+                if new is None:
+                    print(f'no run {args.against} for {args.machine} in {args.store}')
+                    return 2
+            else:
+                new = fresh(base['size'], base['repeat'])
+                if args.save:
+                    runs[key] = new
+                    save_store(args.store, store)
+            rows = compare(base['results'], new['results'], args.tolerance, args.sigma)
+            print(f'{"benchmark":<18} {args.baseline:>10} {(args.against or key):>10} {"change":>8}')
+            for name, b, n, change, status in rows:
+                print(f'{name:<18} {b:>9.4f}s {n:>9.4f}s {change:>+8.1%}  {status}')
+            return int(any(row[-1] == 'REGRESSED' for row in rows))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
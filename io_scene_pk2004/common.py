@@ -1,19 +1,33 @@
 import array
-import bmesh
+import bisect
 import bpy
+import hashlib
 import io
+import multiprocessing
 import mathutils
 import os
 import numpy as np
 import re
+import runpy
+import shutil
 import struct
+import sys
+import tempfile
+import threading
 import time
 from bpy_extras import anim_utils
 from bpy_extras import image_utils
 from bpy_extras.node_shader_utils import PrincipledBSDFWrapper
-from dataclasses import dataclass
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass, field
 from pathlib import Path
-from types import SimpleNamespace
+from queue import Empty, Queue
+from types import ModuleType, SimpleNamespace
+from . import perf
+from . import convert as _convert
+from .convert import VERTEX, ConvertFaces
 
 
 global mtl_cache
@@ -32,52 +46,62 @@ def set_glob(params):
     image_cache = {}
 
 
-@dataclass
-class MeshIn:
-    meshname: str
-    numchannels: int
-    numVerts: int
-    verts: []
-    numFaces: int
-    faces: []
-    nummat: int
-    mat: []
-    normalmap: str
+def _vec(n):
+    return field(default_factory=lambda: np.zeros((0,n), dtype=np.float32))
 
-    type: int
-    index: int
-    size: int
-    offset: int
 
+def pk2bl(a):
+    # (x,z,-y) as stored in files -> blender (x,y,z)
+    return a[:,[0,2,1]] * np.float32((1,-1,1))
 
-@dataclass
-class Vertex:
-    x: float
-    y: float
-    z: float
-    nx: float
-    ny: float
-    nz: float
-    u: float
-    v: float
-    u2: float
-    v2: float
 
+def flipv(uv):
+    return uv * np.float32((1,-1)) + np.float32((0,1))
 
-@dataclass
-class Face:
-    v0: int
-    v1: int
-    v2: int
 
-
-@dataclass
+@dataclass(slots=True)
+class MeshIn:
+    meshname: str = ''
+    numchannels: int = 2
+    # per vertex, blender space : co, normals (n,3) & uv0, uv1 (n,2) float32
+    co: np.ndarray = _vec(3)
+    normals: np.ndarray = _vec(3)
+    uv0: np.ndarray = _vec(2)
+    uv1: np.ndarray = _vec(2)
+    # (n,3) uint32, blender winding
+    faces: np.ndarray = field(default_factory=lambda: np.zeros((0,3), dtype=np.uint32))
+    mat: list = field(default_factory=list)
+    normalmap: str = ''
+
+    type: int = 0x02
+    index: int = 0
+    size: int = 0
+    offset: int = 0
+    weights: SimpleNamespace = None # PKMDL : counts, bone_idx, weight
+
+    @property
+    def numVerts(self): return len(self.co)
+
+    @property
+    def numFaces(self): return len(self.faces)
+
+    @property
+    def nummat(self): return len(self.mat)
+
+    @property
+    def nbytes(self):
+        arrays = [self.co, self.normals, self.uv0, self.uv1, self.faces]
+        if self.weights is not None: arrays += vars(self.weights).values()
+        return sum(a.nbytes for a in arrays)
+
+
+@dataclass(slots=True)
 class UV:
     u: float
     v: float
 
 
-@dataclass
+@dataclass(slots=True)
 class Material:
     offset: int
     size: int
@@ -95,17 +119,142 @@ class Material:
     alphaTiling: UV
 
 
-@dataclass
+def packVerts(verts, *names):
+    # the named VERTEX fields of every vertex back to back, None : a zero float
+    layout = np.dtype([(name, VERTEX.fields[name][0]) if name else (f'_{i}', '<f4') for i,name in enumerate(names)])
+    out = np.zeros(len(verts), dtype=layout)
+    for name in names:
+        if name: out[name] = verts[name]
+    return out.tobytes()
+
+
+@dataclass(slots=True)
 class MeshOut:
     name: str
-    bbox: []
+    bbox: bytes
     numUVs: int
-    verts: []
-    faces: []
-    mtls: {}
-    materials: []
-    lm: ''
+    verts: np.ndarray     # VERTEX
+    faces: np.ndarray     # (n,3) uint32
+    mtls: np.ndarray      # (n,2) uint32 runs : face count, material index
+    materials: list
+    lm: str
+    type: int = 0x02
+    weights: SimpleNamespace = None # PKMDL : counts, bone_idx, weight
+    key: str = None                 # content hash of the inputs (None : not cached)
+
+
+@dataclass(slots=True)
+class Chunk:
+    # an object as its writer serialized it
+    name: str
     type: int
+    data: bytes
+    size: int = 0                   # DAT : object size of the header
+    notes: tuple = ()               # (message, icon) reported when it was made, said again on a hit
+
+
+class ChunkCache:
+    # serialized objects by content hash : the most recently used 'limit'
+    # bytes of them in memory, and all of them in files under 'path' (None :
+    # this session only)
+    def __init__(self, limit):
+        self.enabled = True
+        self.path = None
+        self.limit = limit
+        self.items = {}
+        self.nbytes = 0
+
+    def get(self, key):
+        chunk = self.items.pop(key, None)
+        if chunk is None:
+            chunk = self.read(key)
+            if chunk is None: return None
+        else:
+            self.nbytes -= len(chunk.data)
+        self.keep(key, chunk)
+        return chunk
+
+    def put(self, key, chunk):
+        if key in self.items: self.nbytes -= len(self.items.pop(key).data)
+        self.keep(key, chunk)
+        self.write(key, chunk)
+
+    def keep(self, key, chunk):
+        self.items[key] = chunk
+        self.nbytes += len(chunk.data)
+        while self.nbytes > self.limit and len(self.items) > 1:
+            self.nbytes -= len(self.items.pop(next(iter(self.items))).data)
+
+    def read(self, key):
+        if not self.path: return None
+        try:
+            with open(os.path.join(self.path, key + '.chunk'), 'rb') as file:
+                type, size, namelen, noteslen = struct.unpack('<4I', file.read(16))
+                name = file.read(namelen).decode('utf-8')
+                notes = file.read(noteslen).decode('utf-8')
+                notes = tuple(tuple(note.split('\0')) for note in notes.split('\n') if note)
+                return Chunk(name, type, file.read(), size, notes)
+        except (OSError, struct.error, UnicodeDecodeError):
+            return None
+
+    def write(self, key, chunk):
+        if not self.path: return
+        # through a temporary file : a broken write never leaves a chunk behind
+        try:
+            os.makedirs(self.path, exist_ok=True)
+            name = chunk.name.encode('utf-8')
+            notes = '\n'.join('\0'.join(note) for note in chunk.notes).encode('utf-8')
+            with tempfile.NamedTemporaryFile(dir=self.path, delete=False) as file:
+                file.write(struct.pack('<4I', chunk.type, chunk.size, len(name), len(notes)) + name + notes)
+                file.write(chunk.data)
+            os.replace(file.name, os.path.join(self.path, key + '.chunk'))
+        except OSError as e:
+            info('chunk cache not written (%s)' % e, icon='WARNING')
+
+
+chunks = ChunkCache(256*1024*1024)
+CHUNK_VERSION = 2 # bump when the serialization of an object (or a chunk file) changes
+
+
+def ChunkPath():
+    # the disk cache next to the saved .blend (None : not saved yet)
+    if not bpy.data.filepath: return None
+    return os.path.splitext(bpy.data.filepath)[0] + '_pk2004_cache'
+
+
+def ChunkKey(job, params):
+    # content hash of all an object's serialization depends on : the extracted
+    # (transformed) mesh, materials, names, export options, and for PKMDL the
+    # skinning inputs and weight limits
+    (filetype, bOptimize, bAll, bSelection, bVisible, bSort, scale, *rest) = params
+    h = hashlib.blake2b(digest_size=16)
+    portal = None if job.portal is None else [tuple(v) for v in job.portal]
+    h.update(repr((CHUNK_VERSION, filetype, bOptimize, bSort, scale, rest[1:], job.ob.name, job.type,
+        job.bRound, job.numUVs, job.lm, job.materials, portal)).encode())
+    h.update(job.bbox)
+    arrays = job.arrays
+    for a in (arrays.co, arrays.verts, arrays.normals, arrays.uv0, arrays.uv1, job.mtls):
+        h.update(b'-' if a is None else np.ascontiguousarray(a).tobytes())
+    if job.groups is not None:
+        h.update(repr(job.groups.bones).encode())
+        for a in (job.groups.vi, job.groups.bi, job.groups.wt):
+            h.update(np.ascontiguousarray(a).tobytes())
+    return h.hexdigest()
+
+
+def ObjectChunk(ob, dump, sizeof=None, notes=()):
+    # Chunk of a MeshOut as 'dump' writes it, kept in the cache if keyed with
+    # the 'notes' reported while making it ; a Chunk (cache hit) as it is,
+    # its notes reported again
+    if isinstance(ob, Chunk):
+        for msg,icon in ob.notes: info(msg, icon=icon)
+        return ob
+    for msg,icon in notes: info(msg, icon=icon)
+    buf = io.BytesIO()
+    dump(buf, ob)
+    chunk = Chunk(ob.name, ob.type, buf.getvalue(), sizeof(ob) if sizeof else 0, tuple(notes))
+    if ob.key is not None: chunks.put(ob.key, chunk)
+    return chunk
 
     
 zone = [
@@ -143,7 +292,27 @@ def fname(filepath):
     return os.path.basename(filepath).split('.', 1)[0]
 
 
-def getMaterial(mtl):
+def getMaterial(mtl, cache=None):
+    # material descriptor, cache : {key: descriptor} of one export, so every
+    # material shared by several objects is read once
+    if cache is None: return ReadMaterial(mtl)
+    key = MaterialKey(mtl)
+    material = cache.get(key)
+    if material is None:
+        material = cache[key] = ReadMaterial(mtl)
+    return material
+
+
+def MaterialKey(mtl):
+    # the datablock and the state of its node tree (no update counter in
+    # blender : the tree and the numbers of its nodes and links stand for it)
+    if mtl is None: return None
+    tree = mtl.node_tree if mtl.use_nodes else None
+    if tree is None: return (mtl.as_pointer(), None)
+    return (mtl.as_pointer(), tree.as_pointer(), len(tree.nodes), len(tree.links))
+
+
+def ReadMaterial(mtl):
     material = {
     'color': 'notex',
     'c_loc': [0.0,0.0],
@@ -155,161 +324,119 @@ def getMaterial(mtl):
     'alpha': '',
     'PBimg': '', # likely 'Pre-Biased'
     }
-    if mtl and mtl.use_nodes:
-        wrapper = PrincipledBSDFWrapper(mtl)
-        # normalmap
+    if not (mtl and mtl.use_nodes): return material
+
+    # a linked socket is a layout this reads : failing past it is reported
+    def failed(what, e):
+        info('material \'%s\' : %s not read (%s: %s)' % (mtl.name, what, type(e).__name__, e), icon='WARNING')
+
+    bsdf = PrincipledBSDFWrapper(mtl, is_readonly=True).node_principled_bsdf
+    if bsdf is None: return material
+    # normalmap
+    if bsdf.inputs['Normal'].is_linked:
         try:
-            normal = wrapper.node_principled_bsdf.inputs['Normal'].links[0].from_node
+            normal = bsdf.inputs['Normal'].links[0].from_node
             tex_image = normal.inputs['Color'].links[0].from_node
             material['PBimg'] = fname(tex_image.image.name)
-        except: pass
-        # lightmap
+        except Exception as e: failed('normal map', e)
+    # lightmap
+    if bsdf.inputs['Emission Color'].is_linked:
         try:
-            mix_rgb = wrapper.node_principled_bsdf.inputs['Emission Color'].links[0].from_node
+            mix_rgb = bsdf.inputs['Emission Color'].links[0].from_node
             color = mix_rgb.inputs['Color2'].links[0].from_node
             tex_image = color.inputs['Color1'].links[0].from_node
             material['light'] = fname(tex_image.image.name)
-        except: pass
-        # diffuse only
+        except Exception as e: failed('light map', e)
+    if not bsdf.inputs['Base Color'].is_linked: return material
+    node = bsdf.inputs['Base Color'].links[0].from_node
+    # diffuse only
+    if node.bl_idname == 'ShaderNodeTexImage':
         try:
             # color
-            tex_image = wrapper.base_color_texture
-            material['color'] = fname(tex_image.image.name)
-            return material
-        except: pass
-        # blended
-        try:
-            mix_rgb = wrapper.node_principled_bsdf.inputs['Base Color'].links[0].from_node
-            # color
-            tex_image = mix_rgb.inputs['Color1'].links[0].from_node
-            material['color'] = fname(tex_image.image.name)
-            mapping = tex_image.inputs['Vector'].links[0].from_node        
-            material['c_loc'] = mapping.inputs['Location'].default_value[0], mapping.inputs['Location'].default_value[1]
-            material['c_scl'] = 1/mapping.inputs['Scale'].default_value[0], 1/mapping.inputs['Scale'].default_value[1]
-            # blend
-            tex_image = mix_rgb.inputs['Color2'].links[0].from_node
-            material['blend'] = fname(tex_image.image.name)
-            mapping = tex_image.inputs['Vector'].links[0].from_node
-            material['b_loc'] = mapping.inputs['Location'].default_value[0], mapping.inputs['Location'].default_value[1]
-            material['b_scl'] = 1/mapping.inputs['Scale'].default_value[0], 1/mapping.inputs['Scale'].default_value[1]
-            # alpha
-            tex_image = mix_rgb.inputs['Fac'].links[0].from_node
-            material['alpha'] = fname(tex_image.image.name)
-            return material
-        except: pass
+            material['color'] = fname(node.image.name)
+        except Exception as e: failed('color map', e)
+        return material
+    # blended
+    try:
+        mix_rgb = node
+        # color
+        tex_image = mix_rgb.inputs['Color1'].links[0].from_node
+        material['color'] = fname(tex_image.image.name)
+        mapping = tex_image.inputs['Vector'].links[0].from_node
+        material['c_loc'] = mapping.inputs['Location'].default_value[0], mapping.inputs['Location'].default_value[1]
+        material['c_scl'] = 1/mapping.inputs['Scale'].default_value[0], 1/mapping.inputs['Scale'].default_value[1]
+        # blend
+        tex_image = mix_rgb.inputs['Color2'].links[0].from_node
+        material['blend'] = fname(tex_image.image.name)
+        mapping = tex_image.inputs['Vector'].links[0].from_node
+        material['b_loc'] = mapping.inputs['Location'].default_value[0], mapping.inputs['Location'].default_value[1]
+        material['b_scl'] = 1/mapping.inputs['Scale'].default_value[0], 1/mapping.inputs['Scale'].default_value[1]
+        # alpha
+        tex_image = mix_rgb.inputs['Fac'].links[0].from_node
+        material['alpha'] = fname(tex_image.image.name)
+    except Exception as e: failed('blended maps', e)
     return material
 
 
-def triangulate_object( mesh, bSort ):
-    bm = bmesh.new()
-    bm.from_mesh(mesh)
-    bmesh.ops.triangulate(bm, faces=bm.faces[:])
+def MeshArrays(mesh, bSort=False, matrix=None):
+    # the per-corner inputs of ConvertFaces and the material of every triangle,
+    # read with foreach_get from the loop triangles : no bmesh round trip.
+    # bSort : triangles grouped by material, in their order otherwise
+    # matrix : transform applied to positions and normals, as mesh.transform()
+    mesh.calc_loop_triangles()
+    numtris = len(mesh.loop_triangles)
+    loops = np.empty(numtris*3, dtype=np.int32)
+    mesh.loop_triangles.foreach_get('loops', loops)
+    mat = np.empty(numtris, dtype=np.int32)
+    mesh.loop_triangles.foreach_get('material_index', mat)
     if bSort:
-        bm.faces.sort(key=lambda f: f.material_index)
-        bm.faces.index_update()
-    bm.to_mesh(mesh)
-    bm.free()
-
+        order = np.argsort(mat, kind='stable')
+        loops = loops.reshape(-1,3)[order].ravel()
+        mat = mat[order]
 
-def _map_n_pack( verts ):
-    output = []
-    for vert in verts:
-        key = list(vert.keys())[0]
-        normal = vert.get(key)
-        output.append(key[0:12] + struct.pack('<3f', normal[0], normal[2], -normal[1]) + key[12:28])
-    return output
+    co = np.empty(len(mesh.vertices)*3, dtype=np.float32)
+    mesh.vertices.foreach_get('co', co)
+    loop_vert = np.empty(len(mesh.loops), dtype=np.int32)
+    mesh.loops.foreach_get('vertex_index', loop_vert)
+    verts = loop_vert[loops]
 
-
-def ConvertToMPKFaces( mesh, bRound, bOptimize ):
     match mesh.normals_domain:
         case 'POINT':
-            normal_source = mesh.vertex_normals
+            normals = np.empty(len(mesh.vertex_normals)*3, dtype=np.float32)
+            mesh.vertex_normals.foreach_get('vector', normals)
+            corners = verts
         case 'CORNER' | 'FACE':
-            normal_source = mesh.corner_normals
+            normals = np.empty(len(mesh.corner_normals)*3, dtype=np.float32)
+            mesh.corner_normals.foreach_get('vector', normals)
+            corners = loops
         case _:
             # Unreachable
             raise AssertionError('Unexpected normals domain \'%s\'' % mesh.normals_domain)
+    co = co.reshape(-1,3)
+    normals = normals.reshape(-1,3)
 
-    np.empty(len(normal_source) * 3, dtype=[])
-    t_normal = np.empty(len(normal_source) * 3, dtype=np.single)
-    normal_source.foreach_get('vector', t_normal)
-
-    uvl_1 = mesh.uv_layers[0].data[:] if len(mesh.uv_layers) > 0 else None
-    uvl_2 = mesh.uv_layers[1].data[:] if len(mesh.uv_layers) > 1 else None
-    srcvt = [] # for weights mapping
-    verts = []
-    faces = []
-    vWritten = {}
-
-    i = 0
-    split = len(t_normal)/3 == len(mesh.polygons)*3
-
-    for pl in mesh.polygons:
-        ii = 0
-        face = []
-        for j,v in enumerate(pl.vertices):
-            vert = {}
-            # coords
-            x,y,z = mesh.vertices[v].co
-            if bRound: x = round(x,4); y = round(y,4); z = round(z,4)
-            # UVs
-            uv1 = uv2 = [0.0,1.0]
-            if uvl_2 is not None:
-                uv2=uvl_2[pl.loop_start + ii].uv
-                uv1=uvl_1[pl.loop_start + ii].uv
-            elif uvl_1 is not None:
-                uv1=uvl_1[pl.loop_start + ii].uv
-            ii += 1
-            # normals
-            idx = (v*3,i) [split]; i += 3
-            vn = []
-            for iii in range(3):
-                vn.append(t_normal[idx + iii])
-            normal = mathutils.Vector(vn)
-            if bOptimize:
-                key = struct.pack('<7f', x, z, -y, uv1[0], 1-uv1[1], uv2[0], 1-uv2[1])
-                double = vWritten.get(key)
-                if bool(double):
-                    index = None
-                    for vrt in double:
-                        vdata = vrt.get(key)
-                        if vdata and (vdata[0]@normal)>0.9999:
-                            index = vdata[1]
-                            break
-                    if index is None:
-                        vWritten[key].append({key : [normal,len(verts)]})
-                        face.append(len(verts))
-                        vert[key] = normal
-                        verts.append(vert)
-                    else: face.append(index)
-                else:
-                    vWritten[key] = [{key : [normal,len(verts)]}]
-                    face.append(len(verts))
-                    vert[key] = normal
-                    verts.append(vert)
-            else: # default
-                key = struct.pack('<10f', x, z, -y, normal[0], normal[2], -normal[1], uv1[0], 1-uv1[1], uv2[0], 1-uv2[1])
-                double = vWritten.get(v)
-                if bool(double):
-                    index = None
-                    for vrt in double:
-                        index = vrt.get(key)
-                        if index: break
-                    if index is None:
-                        vWritten[v].append({key : len(verts)})
-                        face.append(len(verts))
-                        verts.append(key)
-                    else: face.append(index)
-                else:
-                    vWritten[v] = [{key : len(verts)}]
-                    face.append(len(verts))
-                    verts.append(key)
-            if len(verts)>len(srcvt): srcvt.append(v)
-        faces.append(face)
-    if bOptimize:
-        return _map_n_pack(verts), faces, srcvt
-    else:
-        return verts, faces, srcvt
+    if matrix is not None:
+        # positions by the matrix, normals by its inverse transpose (flipped
+        # if it mirrors, as the winding stays), then unit length again
+        m = np.array(matrix, dtype=np.float64)
+        co = (co @ m[:3,:3].T + m[:3,3]).astype(np.float32)
+        n = np.linalg.inv(m[:3,:3]) * np.sign(np.linalg.det(m[:3,:3]))
+        normals = normals @ n
+        length = np.linalg.norm(normals, axis=1, keepdims=True)
+        normals = (normals / np.where(length > 0, length, 1)).astype(np.float32)
+    normals = normals[corners]
+
+    uvs = [None, None]
+    for i,layer in enumerate(mesh.uv_layers[:2]):
+        uv = np.empty(len(mesh.loops)*2, dtype=np.float32)
+        layer.data.foreach_get('uv', uv)
+        uvs[i] = uv.reshape(-1,2)[loops]
+
+    return SimpleNamespace(co=co, verts=verts, normals=normals, uv0=uvs[0], uv1=uvs[1]), mat
+
+
+def ConvertToMPKFaces( mesh, bRound, bOptimize ):
+    return ConvertFaces(MeshArrays(mesh)[0], bRound, bOptimize)
 
 
 def read_triangle_strip(file,geom):
@@ -331,18 +458,11 @@ def read_triangle_strip(file,geom):
             vl[j] = read_short(file)
             if (vl[j - 2] == vl[j - 1] or vl[j - 1] == vl[j - 0] or vl[j - 2] == vl[j - 0]) or j < offset + 2 or j > length: continue
 
-            face = Face(0, 0, 0)
             if (j - offset) % 2 == 0:
-                face.v0 = vl[j - 0]
-                face.v1 = vl[j - 1]
-                face.v2 = vl[j - 2]
+                faces.append((vl[j - 0], vl[j - 1], vl[j - 2]))
             else:
-                face.v0 = vl[j - 2]
-                face.v1 = vl[j - 1]
-                face.v2 = vl[j - 0]
-            faces.append(face)
-        geom.numFaces = len(faces)
-        geom.faces = faces
+                faces.append((vl[j - 2], vl[j - 1], vl[j - 0]))
+        geom.faces = np.array(faces, dtype=np.uint32).reshape(-1,3)
 
 
 def getGeometry(file, context, global_matrix, params):
@@ -379,8 +499,6 @@ def getGeometry(file, context, global_matrix, params):
     if global_matrix is None:
         global_matrix = mathutils.Matrix()
 
-    mesh_objects = []
-
     object_filter={'WORLD', 'MESH'}
 
     if bSelection:
@@ -396,142 +514,319 @@ def getGeometry(file, context, global_matrix, params):
         org_mode = active_object.mode
         bpy.ops.object.mode_set(mode='OBJECT')
 
-    for ob in objects:
-        if ob.type not in {'MESH', 'CURVE', 'SURFACE', 'FONT', 'META'}:
-            continue
-        arm_mod = next((mod for mod in ob.modifiers if mod.type == 'ARMATURE' and mod.object == arm_obj), None)
-        if arm_obj and not arm_mod: continue
+    # conversions run in worker processes (if worth it) while the next objects
+    # are evaluated, results are taken in object order
+    pool = ConversionPool(sum(len(ob.data.loops) for ob in objects if ob.type == 'MESH'))
+    window = 2 * (workers or os.cpu_count() or 1) if pool else 0
+    pending = deque()
+    mtl_cache = {} # materials read so far
+    try:
+        for ob in objects:
+            if ob.type not in {'MESH', 'CURVE', 'SURFACE', 'FONT', 'META'}:
+                continue
+            arm_mod = next((mod for mod in ob.modifiers if mod.type == 'ARMATURE' and mod.object == arm_obj), None)
+            if arm_obj and not arm_mod: continue
+
+            # one object at a time : evaluate, extract, free. plain meshes (no
+            # modifiers, shape keys nor constraints) are read as they are, without
+            # an evaluated copy. either way the mesh stays untransformed and the
+            # extracted arrays are : normals are transformed, not recomputed from
+            # transformed positions (whose rounding splits flat faces' corners)
+            matrix = mtx_scale @ global_matrix @ ob.matrix_world
+            plain = ob.type == 'MESH' and not ob.modifiers and not ob.constraints and not ob.data.shape_keys
+            ob_eval = None
+            with perf.phase('evaluate'):
+                if plain:
+                    mesh = ob.data
+                else:
+                    ob_eval = ob.evaluated_get(depsgraph)
+                    try:
+                        mesh = ob_eval.to_mesh()
+                    except Exception:
+                        mesh = None
+            perf.count('plain', int(plain), ob=ob.name)
+            if not mesh: continue
+            try:
+                job = PrepareObject(ob, mesh, params, matrix, mtl_cache)
+            finally:
+                if ob_eval: ob_eval.to_mesh_clear()
+            # unchanged objects come from the chunk cache, unconverted
+            job.key = ChunkKey(job, params) if chunks.enabled else None
+            job.chunk = chunks.get(job.key) if job.key else None
+            if job.chunk is None:
+                job.future = SubmitConversion(pool, job, bOptimize)
+            else:
+                job.arrays = None
+            pending.append(job)
+
+            while len(pending) > window:
+                geom = FinishObject(pending.popleft(), params)
+                if geom is not None: yield geom
+        while pending:
+            geom = FinishObject(pending.popleft(), params)
+            if geom is not None: yield geom
+    finally:
+        # the pool stays for the next export, conversions not taken are dropped
+        for job in pending:
+            if job.future is not None: job.future.cancel()
+        if active_object and org_mode:
+            context.view_layer.objects.active = active_object
+            if bpy.ops.object.mode_set.poll():
+                bpy.ops.object.mode_set(mode=org_mode)
+
+
+workers = None    # conversion processes (None : one per core, 1 : none, all on this thread)
+PARALLEL = 500000 # fewest corners of an export worth converting in processes
+SMALL = 20000     # objects with fewer corners convert on this thread anyway
+_pool = None      # (processes, executor) kept from one export to the next
+
+
+@contextmanager
+def WithoutMain():
+    # spawned processes import the parent's __main__ again : a script run by
+    # blender imports bpy at the top, which a plain python process can't.
+    # the pool starts its processes in submit(), hide __main__ meanwhile :
+    # convert.py is all a worker needs
+    main = sys.modules['__main__']
+    sys.modules['__main__'] = ModuleType('__main__')
+    try:
+        yield
+    finally:
+        sys.modules['__main__'] = main
+
+
+def ConversionPool(numcorners):
+    # process pool for ConvertFaces, None : convert on this thread. the
+    # workers load convert.py by path, never the add-on package nor bpy.
+    # one pool serves every export, started once (spawn is slow)
+    global _pool
+    count = workers or os.cpu_count() or 1
+    if count < 2 or numcorners < PARALLEL: return None
+    if _pool is not None and (_pool[0] != count or _pool[1]._broken):
+        ShutdownPool()
+    if _pool is None:
+        _pool = count, ProcessPoolExecutor(count,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=runpy.run_path,
+            initargs=(_convert.__file__, {'MODULE': _convert.__name__}, '__pk2004_worker__'))
+    return _pool[1]
+
+
+def ShutdownPool():
+    global _pool
+    if _pool is not None: _pool[1].shutdown(cancel_futures=True)
+    _pool = None
+
+
+def PoolFailed(e):
+    # the processes broke : say so once and drop the pool (the next export
+    # starts a new one), conversions go on on this thread
+    if _pool is None: return
+    info('conversion processes failed (%s: %s) : converting on this thread' % (type(e).__name__, e), icon='WARNING')
+    ShutdownPool()
+
+
+def SubmitConversion(pool, job, bOptimize):
+    # None : convert in FinishObject, on this thread
+    if pool is None or len(job.arrays.verts) < SMALL: return None
+    try:
+        with WithoutMain():
+            return pool.submit(ConvertFaces, job.arrays, job.bRound, bOptimize)
+    except Exception as e:
+        PoolFailed(e)
+        return None
+
+
+def PrepareObject(ob, mesh, params, matrix=None, cache=None):
+    # everything of an evaluated object that needs bpy. matrix : the mesh is
+    # untransformed, apply it to the extracted arrays. cache : getMaterial's
+    (filetype, bOptimize, bAll, bSelection, bVisible, bSort, scale, *rest) = params
 
-        ob_eval = ob.evaluated_get(depsgraph)
-        try:
-            data = ob_eval.to_mesh()
-        except Exception:
-            data = None
+    job = SimpleNamespace(ob=ob, future=None, portal=None)
+    job.bRound = bool(re.search(r'(?=(' + '|'.join(zone) + r'))', ob.name, re.IGNORECASE))
+    with perf.phase('extract'):
+        job.arrays, mat = MeshArrays(mesh, bSort, matrix)
+
+    # material runs : triangle count, material index
+    starts = np.flatnonzero(np.diff(mat, prepend=-1))
+    counts = np.diff(starts, append=len(mat))
+    job.mtls = np.column_stack((counts, mat[starts])).astype(np.uint32)
+
+    with perf.phase('materials'):
+        materials = ([getMaterial(None, cache)],[])[bool(ob.material_slots)]
+        for slot in ob.material_slots:
+            mtl = getMaterial(slot.material, cache)
+            materials.append(mtl)
+    perf.count('materials', len(materials), ob=ob.name)
+    job.materials = materials
 
-        if data:
-            matrix = global_matrix @ ob.matrix_world
-            data.transform(matrix)
-            data.transform(mtx_scale)
-            mesh_objects.append((ob, data, matrix))
+    job.numUVs = 2 if len(mesh.uv_layers) > 1 else 1
+
+    job.lm = ''
+    if job.numUVs == 2:
+        colls = ob.users_collection
+        if colls[0].name != 'Scene Collection':
+            job.lm = colls[0].name
+        else:
+            job.lm = ob.name + '_L_0000'
+
+    # bounding box
+    mtx_scale = mathutils.Matrix.Scale(scale, 4)
+    bbox_corners = [ob.matrix_world @ mathutils.Vector(corner) for corner in ob.bound_box]
+    p1 = bbox_corners[3] @ pkspc @ mtx_scale
+    p2 = bbox_corners[5] @ pkspc @ mtx_scale
+    job.bbox = struct.pack('<6f', p1.x, p1.y, p1.z, p2.x, p2.y, p2.z)
+
+    job.groups = None
+    if filetype == 'PKMDL':
+        with perf.phase('weights'):
+            job.groups = VertexGroups(rest[0], ob)
+
+    job.type = 0x02
+    if filetype == 'DAT':
+        if re.search(r'zone'  , ob.name, re.IGNORECASE): job.type = 0x04 # b00100
+        if re.search(r'portal', ob.name, re.IGNORECASE): job.type = 0x08 # b01000
+        if re.search(r'antyp' , ob.name, re.IGNORECASE): job.type = 0x10 # b10000
+        if job.type == 0x08:
+            v0 = 3
+            v1 = (2,6)[p1.y==p2.y]
+            v2 = 5
+            v3 = (4,0)[p1.y==p2.y]
+            job.portal = [bbox_corners[v] @ pkspc for v in [v0,v1,v2,v3]]
+    return job
+
+
+def FinishObject(job, params):
+    # MeshOut of a prepared object, once converted (None : rejected, Chunk :
+    # unchanged since cached)
+    (filetype, bOptimize, bAll, bSelection, bVisible, bSort, scale, *rest) = params
 
-    output = SimpleNamespace(geom = [], bIsItem = True)
     bSpecLimit = filetype=='DAT' or filetype=='PKMDL'
     limit = (0xffff,0xffffffff)[bSpecLimit]
-    for ob, mesh, matrix in mesh_objects:
-        triangulate_object( mesh, bSort )
+    ob = job.ob
 
-        bRound = re.search(r'(?=(' + '|'.join(zone) + r'))', ob.name, re.IGNORECASE)
-        verts, faces, srcvt = ConvertToMPKFaces( mesh, bRound, bOptimize )
+    if job.chunk is not None:
+        perf.count('cached', 1, ob=ob.name)
+        return job.chunk
 
-        if len(verts) == 0 or len(faces) == 0: continue
-        
-        if len(verts)>limit:
-            info('\'%s\' is rejected : too many vertices (> %d)' % (ob.name,limit), icon='WARNING')
-            continue
-        if len(faces)>limit:
-            info('\'%s\' is rejected : too many faces (> %d)' % (ob.name,limit), icon='WARNING')
-            continue
-        if bSpecLimit:
+    with perf.phase('convert'):
+        if job.future is None:
+            verts, faces, srcvt = ConvertFaces(job.arrays, job.bRound, bOptimize)
+        else:
             try:
-                for f in faces:
-                    assert(f[0]<=0xffff and f[2]<=0xffff and f[1]<=0xffff)
-            except:
-                info('\'%s\' is rejected : too many faces' % ob.name, icon='WARNING')
-                continue
-
-        mtls = {}; _idx = None; i=0
-        for pl in mesh.polygons:
-            idx = pl.material_index
-            if _idx != idx:
-                mtls[i]=[1,idx]
-                _idx = idx
-                i += 1
-            else:
-                mtl = mtls.get(i-1)
-                mtls[i-1] = mtl[0]+1,mtl[1]
+                verts, faces, srcvt = job.future.result()
+            except Exception as e:
+                # the pool broke : convert here
+                PoolFailed(e)
+                verts, faces, srcvt = ConvertFaces(job.arrays, job.bRound, bOptimize)
+    job.arrays = job.future = None
+    perf.count('verts', len(verts), ob=ob.name)
+    perf.count('faces', len(faces), ob=ob.name)
+
+    if len(verts) == 0 or len(faces) == 0: return None
+    
+    if len(verts)>limit:
+        info('\'%s\' is rejected : too many vertices (%d > %d)' % (ob.name,len(verts),limit), icon='WARNING')
+        return None
+    if len(faces)>limit:
+        info('\'%s\' is rejected : too many faces (%d > %d)' % (ob.name,len(faces),limit), icon='WARNING')
+        return None
+    if bSpecLimit and faces.max() > 0xffff:
+        info('\'%s\' is rejected : vertex index %d does not fit 16 bits (%d vertices)' % (ob.name,faces.max(),len(verts)), icon='WARNING')
+        return None
+
+    # first index of every material run
+    sizes = job.mtls[:,0].astype(np.int64) * 3
+    offsets = np.cumsum(sizes) - sizes
+    if len(offsets) and offsets.max() > limit:
+        run = int(np.argmax(offsets > limit))
+        info('\'%s\' is rejected : material run %d starts at index %d (> %d)' % (ob.name,run,offsets[run],limit), icon='WARNING')
+        return None
+
+    if job.portal is not None:
+        verts = np.zeros(4, dtype=VERTEX)
+        verts['pos'] = job.portal
+        faces = np.array([[2,1,0],[0,3,2]], dtype=np.uint32)
+
+    geom = MeshOut(ob.name, job.bbox, job.numUVs, verts, faces, job.mtls, job.materials, job.lm, job.type, key=job.key)
+    if filetype == 'PKMDL':
+        with perf.phase('weights'):
+            bIsOK, geom.weights = GetWeights(job.groups, srcvt)
+        if not bIsOK:
+            info('\'%s\' is rejected : bad skinning' % ob.name, icon='WARNING')
+            return None
+    return geom
+
+
+def VertexGroups(arm_obj, mesh_obj):
+    bone_ids = {bone.name: i for i,bone in enumerate(arm_obj.data.bones)}
+    # vertex group index -> bone index (-1 : not a bone)
+    group_bone = np.array([bone_ids.get(vg.name, -1) for vg in mesh_obj.vertex_groups] + [-1], dtype=np.int32)
+
+    # sparse (vertex, group, weight) table
+    vi = []; gi = []; wt = []
+    for v in mesh_obj.data.vertices:
+        for g in v.groups:
+            vi.append(v.index); gi.append(g.group); wt.append(g.weight)
+    vi = np.array(vi, dtype=np.int64)
+    gi = np.array(gi, dtype=np.int64)
+    wt = np.array(wt, dtype=np.float32)
+    bi = group_bone[gi]
+    keep = bi >= 0
+    vi, bi, wt, gi = vi[keep], bi[keep], wt[keep], gi[keep]
+    order = np.lexsort((gi, vi)) # by vertex, then by group
+    return SimpleNamespace(bones=list(bone_ids), numverts=len(mesh_obj.data.vertices),
+        vi=vi[order], bi=bi[order], wt=wt[order])
+
+
+def GetWeights(groups, srcvt):
+    vi, bi, wt = groups.vi, groups.bi, groups.wt
+
+    # remap source vertices to exported vertices
+    srcvt = np.asarray(srcvt, dtype=np.int64)
+    numsrc = max(groups.numverts, int(srcvt.max(initial=-1)) + 1)
+    start = np.searchsorted(vi, np.arange(numsrc))
+    count = np.bincount(vi, minlength=numsrc)
+    counts = count[srcvt]
+    first = np.repeat(start[srcvt], counts)
+    rank = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    rows = first + rank
+
+    weights = SimpleNamespace(
+        counts  = counts.astype(np.int32),
+        bone_idx= bi[rows].astype(np.uint16),
+        weight  = wt[rows],
+    )
+    bIsOK = bool(np.all(counts > 0))
+    return bIsOK, weights
 
-        try:
-            mtl_offset = 0
-            for mtl in mtls.values():
-                assert(mtl_offset<=limit)
-                mtl_offset += mtl[0]*3
-        except:
-            info('\'%s\' is rejected : too many faces' % ob.name, icon='WARNING')
-            continue
 
-        materials = ([getMaterial(None)],[])[bool(ob.material_slots)]
-        for slot in ob.material_slots:
-            mtl = getMaterial(slot.material)
-            materials.append(mtl)
+def getFCurves(action, slot=None, bEnsure=False):
+    try:     # blender 4
+        return action.fcurves
+    except Exception:
+        try: # blender 5
+            if slot is None: slot = action.slots[0]
+            if bEnsure: return anim_utils.action_ensure_channelbag_for_slot(action, slot).fcurves
+            return anim_utils.action_get_channelbag_for_slot(action, slot).fcurves
+        except: return None
 
-        numUVs = 2 if len(mesh.uv_layers) > 1 else 1
 
-        LightMapName = ''
-        if numUVs == 2:
-            colls = ob.users_collection
-            if colls[0].name != 'Scene Collection':
-                LightMapName = colls[0].name
-            else:
-                LightMapName = ob.name + '_L_0000'
-
-        # bounding box
-        mtx_scale = mathutils.Matrix.Scale(scale, 4)
-        bbox_corners = [ob.matrix_world @ mathutils.Vector(corner) for corner in ob.bound_box]
-        p1 = bbox_corners[3] @ pkspc @ mtx_scale
-        p2 = bbox_corners[5] @ pkspc @ mtx_scale
-        bbox = struct.pack('<6f', p1.x, p1.y, p1.z, p2.x, p2.y, p2.z)
-
-        match filetype:
-            case 'DAT':
-                type = 0x02                                                  # b00010
-                if re.search(r'zone'  , ob.name, re.IGNORECASE): type = 0x04 # b00100
-                if re.search(r'portal', ob.name, re.IGNORECASE): type = 0x08 # b01000
-                if re.search(r'antyp' , ob.name, re.IGNORECASE): type = 0x10 # b10000
-                if type != 0x02: output.bIsItem = False
-                if type == 0x08:
-                    verts = []
-                    v0 = 3
-                    v1 = (2,6)[p1.y==p2.y]
-                    v2 = 5
-                    v3 = (4,0)[p1.y==p2.y]
-                    for v in [v0,v1,v2,v3]:
-                        p = bbox_corners[v] @ pkspc
-                        verts.append(struct.pack('<10f', p.x, p.y, p.z, 0,0,0,0,0,0,0))
-                    faces = [[2,1,0],[0,3,2]]
-                output.geom.append(MeshOut(ob.name, bbox, numUVs, verts, faces, mtls, materials, LightMapName, type))
-            case 'MPK':
-                output.geom.append(MeshOut(ob.name, bbox, numUVs, verts, faces, mtls, materials, LightMapName, 0x02))
-            case 'PKMDL':
-                geom = MeshOut(ob.name, bbox, numUVs, verts, faces, mtls, materials, LightMapName, 0x02)
-                bIsOK, geom.weights = GetWeights(arm_obj, ob, srcvt)
-                if bIsOK: output.geom.append(geom)
-                else: info('\'%s\' is rejected : bad skinning' % ob.name, icon='WARNING')
-
-        ob.to_mesh_clear()
-    
-    if active_object and org_mode:
-        context.view_layer.objects.active = active_object
-        if bpy.ops.object.mode_set.poll():
-            bpy.ops.object.mode_set(mode=org_mode)
-    
-    return output
+def ActionFCurves(obj):
+    # fcurves to key the object's action into, slot & channelbag made if need be (blender 5)
+    anim_data = obj.animation_data
+    slot = getattr(anim_data, 'action_slot', None)
+    if slot is None and hasattr(anim_data, 'action_slot'):
+        slot = anim_data.action.slots.new(obj.id_type, obj.name)
+        anim_data.action_slot = slot
+    return getFCurves(anim_data.action, slot, bEnsure=True)
 
 
-def GetWeights(arm_obj, mesh_obj, srcvt):    
-    bone_names = [bone.name for bone in arm_obj.data.bones]    
-    bIsOK = True
-    weights = []
-    for vert_idx in srcvt:
-        influences = []
-        for vertex_group in mesh_obj.vertex_groups:
-            bone_idx = bone_names.index(vertex_group.name)
-            try:
-                weight = vertex_group.weight(vert_idx)
-                influences.append(SimpleNamespace(bone_idx=bone_idx,weight=weight))
-            except: pass
-        if len(influences)==0: bIsOK = False
-        weights.append(influences)
-    return bIsOK, weights
+def EnsureFCurve(fcurves, data_path, index, group):
+    fcurve = fcurves.find(data_path, index=index)
+    if fcurve: return fcurve
+    try:    return fcurves.new(data_path, index=index, action_group=group) # blender 4
+    except TypeError: return fcurves.new(data_path, index=index, group_name=group) # blender 5
 
 
 def RemoveDoubles():
@@ -555,69 +850,58 @@ def dummyMat(geom):
         '', UV(0, 0), UV(1, 1),
         '', UV(0, 0), UV(1, 1),
         '', UV(0, 0), UV(1, 1))
-    geom.nummat = 1
     geom.mat.append(mat)
 
 
 def BuildMesh(geom):
+    perf.count('verts', geom.numVerts, ob=geom.meshname)
+    perf.count('faces', geom.numFaces, ob=geom.meshname)
+    perf.count('materials', geom.nummat, ob=geom.meshname)
     # GEOMETRY
+    with perf.phase('geometry'):
+        mesh, normals = BuildGeometry(geom)
+    with perf.phase('uvs'):
+        BuildUVs(geom, mesh)
+    with perf.phase('materials'):
+        BuildMaterials(geom, mesh)
+    with perf.phase('finish'):
+        return FinishMesh(geom, mesh, normals)
+
+
+def BuildGeometry(geom):
     mesh = bpy.data.meshes.new(geom.meshname)
     mesh.vertices.add(geom.numVerts)
     mesh.polygons.add(geom.numFaces)
     mesh.loops.add(geom.numFaces * 3)
 
-    # vertices & normals
-    _normals = []
-    for vidx, v in enumerate(mesh.vertices):
-        vert = geom.verts[vidx]
-        v.co.x = vert.x
-        v.co.y = vert.y
-        v.co.z = vert.z
-        _normals.append((vert.nx, vert.ny, vert.nz))
-
-    # faces
-    _faces = []
-    for f in geom.faces:
-        _faces.extend((f.v0, f.v1, f.v2))
-
-    mesh.polygons.foreach_set('loop_start', range(0, geom.numFaces * 3, 3))
-    mesh.loops.foreach_set('vertex_index', _faces)
+    # vertices & faces
+    mesh.vertices.foreach_set('co', geom.co.ravel())
+    mesh.polygons.foreach_set('loop_start', np.arange(0, geom.numFaces * 3, 3, dtype=np.int32))
+    mesh.loops.foreach_set('vertex_index', geom.faces.ravel().astype(np.int32))
     mesh.transform(tm)
 
-    # MATERIALS
-    i = 0
-    j = 0
-    while i < geom.numFaces:
-        if geom.mat[j].size > 0:
-            mesh.polygons[i].material_index = j
-            geom.mat[j].size -= 1
-            i += 1
-        else:
-            if j < geom.nummat - 1:
-                j += 1
-            else:
-                geom.mat[j].size = 0xFFFF
+    # MATERIALS : consecutive runs, the last material takes the remaining faces
+    sizes = [mat.size for mat in geom.mat[:-1]]
+    index = np.repeat(np.arange(len(sizes), dtype=np.int32), sizes)[:geom.numFaces]
+    index = np.concatenate((index, np.full(geom.numFaces - len(index), geom.nummat - 1, dtype=np.int32)))
+    mesh.polygons.foreach_set('material_index', index)
+    return mesh, geom.normals
+
 
+def BuildUVs(geom, mesh):
+    # per loop, faces are triangles in loop order
+    loops = geom.faces.ravel()
     # colormap UVs
-    mesh.uv_layers.new(name='colormap', do_init=False)
-    uvl = mesh.uv_layers.active.data[:]
-    for fidx, pl in enumerate(mesh.polygons):
-        f = geom.faces[fidx]
-        uvl[pl.loop_start + 0].uv = (geom.verts[f.v0].u, geom.verts[f.v0].v)
-        uvl[pl.loop_start + 1].uv = (geom.verts[f.v1].u, geom.verts[f.v1].v)
-        uvl[pl.loop_start + 2].uv = (geom.verts[f.v2].u, geom.verts[f.v2].v)
+    uvl = mesh.uv_layers.new(name='colormap', do_init=False)
+    uvl.data.foreach_set('uv', geom.uv0[loops].ravel())
 
     # lightmap UVs
-    mesh.uv_layers.new(name='lightmap', do_init=False)
-    mesh.uv_layers['lightmap'].active = True
-    uvl = mesh.uv_layers.active.data[:]
-    for fidx, pl in enumerate(mesh.polygons):
-        f = geom.faces[fidx]
-        uvl[pl.loop_start + 0].uv = (geom.verts[f.v0].u2, geom.verts[f.v0].v2)
-        uvl[pl.loop_start + 1].uv = (geom.verts[f.v1].u2, geom.verts[f.v1].v2)
-        uvl[pl.loop_start + 2].uv = (geom.verts[f.v2].u2, geom.verts[f.v2].v2)
+    uvl = mesh.uv_layers.new(name='lightmap', do_init=False)
+    uvl.data.foreach_set('uv', geom.uv1[loops].ravel())
     mesh.uv_layers['colormap'].active = True
 
+
+def BuildMaterials(geom, mesh):
     # textures
     PBimg = None # pkmdl normal map texture
     if len(geom.normalmap) and geom.nummat == 1: PBimg = read_texture_image(geom.normalmap)
@@ -669,9 +953,11 @@ def BuildMesh(geom):
             matname = 'mtl_' + texname
             mtl = mtl_cache.get(matname)
             if mtl is not None:
+                perf.count('material_hits')
                 mesh.materials.append(mtl)  # use existing
                 addtex = False
             else:
+                perf.count('material_misses')
                 bmat = bpy.data.materials.new(matname)
                 mtl_cache[matname] = bmat
 
@@ -698,6 +984,8 @@ def BuildMesh(geom):
             bmat.use_backface_culling = True
             mesh.materials.append(bmat)
 
+
+def FinishMesh(geom, mesh, normals):
     if geom.numchannels < 2:
         lm = mesh.uv_layers['lightmap']
         mesh.uv_layers.remove(lm)
@@ -708,7 +996,7 @@ def BuildMesh(geom):
 
     mesh.polygons.foreach_set('use_smooth', [True] * len(mesh.polygons))
     if not re.search(r'(?=(' + '|'.join(zone) + r'))', geom.meshname, re.IGNORECASE) and geom.type == 0x02:
-        mesh.normals_split_custom_set_from_vertices(_normals)
+        mesh.normals_split_custom_set_from_vertices(normals)
 
     # COLLECTIONS
     ob = bpy.data.objects.new(geom.meshname, mesh)
@@ -751,6 +1039,74 @@ def BuildMesh(geom):
     return ob
 
 
+def decode_ahead(decode, items, sizes, budget=0):
+    # decode items on a thread pool ahead of the caller, in order
+    # budget : bytes of input decoded but not yet handed over (0 : unlimited),
+    # at least one item is always in flight
+    # waiting on a result counts as 'parse'
+    with ThreadPoolExecutor() as pool:
+        pending = deque()
+        inflight = 0
+        for item, size in zip(items, sizes):
+            while pending and budget and inflight + size > budget:
+                future, done = pending.popleft()
+                inflight -= done
+                with perf.phase('parse'): result = future.result()
+                yield result
+            pending.append((pool.submit(decode, item), size))
+            inflight += size
+        while pending:
+            future, done = pending.popleft()
+            with perf.phase('parse'): result = future.result()
+            yield result
+
+
+def prefetch(items, budget=0, depth=4):
+    # run a decoding generator on a background thread while the caller builds
+    # what it already got : at most depth items, and budget bytes of their
+    # arrays (0 : unlimited), wait to be picked up. the generator must not
+    # touch bpy, waiting on it counts as 'wait'
+    ready = Queue(depth)
+    room = threading.Condition()
+    stop = threading.Event()
+    held = 0
+
+    def produce():
+        nonlocal held
+        try:
+            for item in items:
+                size = item.nbytes
+                with room:
+                    room.wait_for(lambda: stop.is_set() or not budget or not held or held + size <= budget)
+                    held += size
+                if stop.is_set(): return
+                ready.put((item, size))
+            ready.put((None, 0))
+        except BaseException as error:
+            ready.put((error, None))
+
+    worker = threading.Thread(target=produce, daemon=True)
+    worker.start()
+    try:
+        while True:
+            with perf.phase('wait'):
+                item, size = ready.get()
+            if size is None: raise item
+            if item is None: break
+            with room:
+                held -= size
+                room.notify_all()
+            yield item
+            item = None
+    finally:
+        # the caller stopped early : unblock the producer and let it finish
+        stop.set()
+        with room: room.notify_all()
+        while worker.is_alive():
+            try: ready.get(timeout=0.05)
+            except Empty: pass
+
+
 SZ_SHORT = struct.calcsize('H')
 SZ_INT = struct.calcsize('I')
 SZ_FLOAT = struct.calcsize('f')
@@ -783,7 +1139,9 @@ def read_texture_image(filepath):
         basename = 'notex'
     image = image_cache.get(basename)
     if image is not None:
+        perf.count('texture_hits')
         return image
+    perf.count('texture_misses')
     image = image_utils.load_image(
         basename + '.dds',
         dirname=dirname,
@@ -805,6 +1163,7 @@ def read_texture_image(filepath):
         recursive=True,
         )
     # set the 'dds' placeholder if no texture found
+    if image is not None: perf.count('textures_loaded')
     if image is None:
         image = image_utils.load_image(
         basename + '.dds',
@@ -0,0 +1,106 @@
+import numpy as np
+
+
+# export conversion on plain arrays : numpy only, no bpy, no add-on imports,
+# so the process pool of getGeometry can load this file on its own (see
+# worker() below)
+#
+#   arrays : SimpleNamespace (or anything with the attributes) of
+#     co      (v,3) float32  vertex positions, blender space
+#     verts   (n,)  int      vertex of every corner, 3 corners per triangle
+#     normals (n,3) float32  normal of every corner
+#     uv0,uv1 (n,2) float32  UVs of every corner (None : no such layer)
+
+
+# exported vertex : x,z,-y / normal / uv0 / uv1 (v flipped), as the files store them
+VERTEX = np.dtype([('pos','<f4',3),('normal','<f4',3),('uv0','<f4',2),('uv1','<f4',2)])
+
+
+def first_unique(keys):
+    # unique keys in order of first appearance : first index of each, id of every key
+    _, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+    order = np.argsort(first, kind='stable')
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    return first[order], rank[inverse.ravel()]
+
+
+def _uv(uv, n):
+    # (u, 1-v), no layer : (0, 0) ; 1-v in double as struct.pack did it
+    if uv is None: return np.zeros((n,2), dtype=np.float32)
+    out = uv.astype(np.float64)
+    out[:,1] = 1 - out[:,1]
+    return out.astype(np.float32)
+
+
+def _round(co):
+    # python's round(), not np.round : the same floats as the exported files ever had
+    return np.array([round(c, 4) for c in co.astype(np.float64).ravel().tolist()]).reshape(-1,3)
+
+
+def _dot(a, b):
+    # mathutils' Vector @ Vector : float products, summed in double from the last one
+    p = (a * b).astype(np.float64)
+    return (p[:,2] + p[:,1]) + p[:,0]
+
+
+def ConvertFaces(arrays, bRound, bOptimize):
+    verts = np.asarray(arrays.verts, dtype=np.int64)
+    numloops = len(verts)
+    co = _round(arrays.co) if bRound else arrays.co
+    pos = co[verts]
+    normals = np.asarray(arrays.normals, dtype=np.float32)
+
+    rows = np.empty(numloops, dtype=VERTEX)
+    rows['pos'] = pos[:,[0,2,1]] * (1,1,-1)
+    rows['normal'] = normals[:,[0,2,1]] * np.float32((1,1,-1))
+    rows['uv0'] = _uv(arrays.uv0, numloops)
+    rows['uv1'] = _uv(arrays.uv1, numloops)
+
+    if bOptimize:
+        # weld corners sharing position & UVs whose normals are (nearly) the same,
+        # across source vertices : the first corner of a group opens a vertex, a
+        # later one joins the first vertex of the group with a normal within 0.9999
+        keys = np.empty(numloops, dtype=[('pos','<f4',3),('uv0','<f4',2),('uv1','<f4',2)])
+        for name in ('pos', 'uv0', 'uv1'): keys[name] = rows[name]
+        _, group = first_unique(keys.view(np.dtype((np.void, keys.dtype.itemsize))))
+        owner = np.full(numloops, -1, dtype=np.int64)
+        rep_of = np.empty(group.max(initial=-1) + 1, dtype=np.int64)
+        todo = np.arange(numloops)
+        while len(todo):
+            # the first corner of every group still left opens the next vertex
+            g = group[todo]
+            _, firsts = np.unique(g, return_index=True)
+            rep_of[g[firsts]] = todo[firsts]
+            rep = rep_of[g]
+            hit = (todo == rep) | (_dot(normals[todo], normals[rep]) > 0.9999)
+            owner[todo[hit]] = rep[hit]
+            todo = todo[~hit]
+        first = np.unique(owner)
+        ids = np.searchsorted(first, owner)
+    else:
+        # corners of a source vertex with the same exported data share one vertex
+        keys = np.empty(numloops, dtype=[('v','<i8'),('row',VERTEX)])
+        keys['v'] = verts
+        keys['row'] = rows
+        first, ids = first_unique(keys.view(np.dtype((np.void, keys.dtype.itemsize))))
+
+    faces = ids.astype(np.uint32).reshape(-1,3)
+    return rows[first], faces, verts[first]
+
+
+def worker(module):
+    # process pool initializer (run with runpy.run_path on this file) : make
+    # the functions importable under their add-on module name, so pickled
+    # calls resolve here without importing the add-on package (and bpy)
+    import sys, types
+    parts = module.split('.')
+    for i in range(1, len(parts)):
+        # empty stand-ins for the packages above
+        package = sys.modules.setdefault('.'.join(parts[:i]), types.ModuleType('.'.join(parts[:i])))
+        package.__path__ = []
+    sys.modules[module] = types.ModuleType(module)
+    sys.modules[module].__dict__.update({k: v for k, v in globals().items() if not k.startswith('__')})
+
+
+if __name__ == '__pk2004_worker__': worker(MODULE)
@@ -18,7 +18,7 @@ def getDATsize(ob):
         return size                                    # Portal
     size += SZ_FLOAT * 16                              # matrix
     size += SZ_INT                                     # 0x0
-    mtl_idx = ob.mtls.get(0)[1]                        
+    mtl_idx = int(ob.mtls[0,1])                        
     mtl = ob.materials[mtl_idx]                        
     texName = mtl.get('light')                         
     if texName is None: texName = fname(ob.lm)         
@@ -27,7 +27,7 @@ def getDATsize(ob):
     size += (SZ_INT + len('notex')+1)                  # 'notex'
     size += SZ_INT                                     # mtlcount
     for i in range(len(ob.mtls)):                      
-        mtl_idx = ob.mtls.get(i)[1]                    
+        mtl_idx = int(ob.mtls[i,1])                    
         mtl = ob.materials[mtl_idx]                    
         size += (SZ_INT + len(mtl.get('color'))+1)     # color
         size += SZ_INT                                 # offset
@@ -43,14 +43,31 @@ def getDATsize(ob):
     return size
 
 
-def dumpDAT(file, data):
-    # header
-    numobj = len(data.geom)
+def dumpDAT(file, geom):
+    # body first : each object goes to a spool as soon as it is converted,
+    # the header (names, types, offsets) only needs what is left of it
+    entries = []
+    with tempfile.TemporaryFile() as body:
+        for ob in geom:
+            with perf.phase('write'):
+                chunk = ObjectChunk(ob, dumpDATobject, getDATsize)
+                body.write(chunk.data)
+            entries.append(SimpleNamespace(name=chunk.name, type=chunk.type, size=chunk.size))
+
+        with perf.phase('write'):
+            writeDATheader(file, entries)
+            body.seek(0)
+            shutil.copyfileobj(body, file)
+
+
+def writeDATheader(file, entries):
+    numobj = len(entries)
+    bIsItem = all(ob.type == 0x02 for ob in entries)
     datfilename = os.path.basename(file.name)
-    if data.bIsItem:
-        data.geom.insert(0, MeshOut(datfilename,[],1,[],[],{},[],'',0x0))
-        data.geom.insert(2, MeshOut('WorldMesh',[],1,[],[],{},[],'',0x0))
-        names = [ob.name for ob in data.geom]
+    if bIsItem:
+        entries.insert(0, SimpleNamespace(name=datfilename, type=0x0, size=0))
+        entries.insert(2, SimpleNamespace(name='WorldMesh', type=0x0, size=0))
+        names = [ob.name for ob in entries]
     else:
         names = [datfilename,'WorldMesh','Zone','Portal','AntiPortal']
     write_long(file,len(names))
@@ -59,8 +76,7 @@ def dumpDAT(file, data):
         writeString(file,name)
     write_long(file,numobj)
     offset = file.tell() + numobj*5*SZ_INT
-    index = 0
-    for idx,ob in enumerate(data.geom):
+    for idx,ob in enumerate(entries):
         if ob.type == 0x0: continue
         write_long(file,0) # 0x0
         """
@@ -73,114 +89,98 @@ def dumpDAT(file, data):
         |  4  | 0x10 | antyp      |
         ---------------------------
         """
-        type = ((ob.type).bit_length()-1,ob.type)[data.bIsItem]
+        type = ((ob.type).bit_length()-1,ob.type)[bIsItem]
         write_long(file,type)
-        write_long(file,(0,idx)[data.bIsItem])
-        size = getDATsize(ob)
-        write_long(file,size)
+        write_long(file,(0,idx)[bIsItem])
+        write_long(file,ob.size)
         write_long(file,offset)
-        offset += size
+        offset += ob.size
 
-    # body
-    for ob in data.geom:
-        if ob.type == 0x0: continue
-        # name
-        write_long(file,len(ob.name)+1)
-        writeString(file,ob.name)
-
-        # ANTYP
-        if ob.type == 0x10:
-            # verts
-            write_long(file,len(ob.verts))
-            for key in ob.verts:
-                file.write(key[0:12])
-            # faces
-            write_long(file,len(ob.faces)*3)
-            for f in ob.faces:
-                write_short(file,f[0])
-                write_short(file,f[2])
-                write_short(file,f[1])
-            continue
-        
-        # flags
-        if ob.type == 0x02:
-            bits = (0x0400,0)[ob.numUVs==2]
-            if re.search(r'barrier', ob.name, re.IGNORECASE): bits = bits | 0x0040        
-            write_long(file,bits)
-
-        # bounding box
-        file.write(ob.bbox)
-
-        # ZONE
-        if ob.type == 0x04: continue
-        # PORTAL
-        if ob.type == 0x08:
-            write_long(file,len(ob.verts))
-            for key in ob.verts:
-                file.write(key[0:12])
-            continue
-
-        # transform matrix
-        dummy = struct.pack('<16f', 1,0,0,0, 0,1,0,0, 0,0,1,0, 0,0,0,1)
-        file.write(dummy)
-
-        # 0x0
-        write_long(file,0)
-
-        # materials
-        mtl_idx = ob.mtls.get(0)[1]
-        mtl = ob.materials[mtl_idx]
-        # light map : 2nd UV-channel
-        texName = mtl.get('light')
-        if texName is None: texName = fname(ob.lm)
-        write_long(file,len(texName)+1)
-        writeString(file,texName)
-        texName = 'notex'
-        write_long(file,len(texName)+1)
-        writeString(file,texName)
-        # colorMaps
-        mtl_offset = 0
-        num_mtls = len(ob.mtls)
-        write_long(file,num_mtls)
-        for i in range(num_mtls):
-            mtl_len = ob.mtls.get(i)[0]
-            mtl_idx = ob.mtls.get(i)[1]
-            mtl = ob.materials[mtl_idx]
-            # color map : 1st UV-channel
-            texName = mtl.get('color')
-            write_long(file,len(texName)+1)
-            writeString(file,texName)   # color
-            write_long(file,mtl_offset) # offset
-            write_long(file,mtl_len)    # size
-            mtl_offset += mtl_len * 3
 
+def dumpDATobject(file, ob):
+    # name
+    write_long(file,len(ob.name)+1)
+    writeString(file,ob.name)
+
+    # ANTYP
+    if ob.type == 0x10:
+        # verts
+        write_long(file,len(ob.verts))
+        file.write(ob.verts['pos'].tobytes())
         # faces
         write_long(file,len(ob.faces)*3)
-        for f in ob.faces:
-            write_short(file,f[0])
-            write_short(file,f[2])
-            write_short(file,f[1])
-        write_long(file,0)        
-        # verts
+        file.write(ob.faces[:,[0,2,1]].astype('<u2').tobytes())
+        return
+    
+    # flags
+    if ob.type == 0x02:
+        bits = (0x0400,0)[ob.numUVs==2]
+        if re.search(r'barrier', ob.name, re.IGNORECASE): bits = bits | 0x0040        
+        write_long(file,bits)
+
+    # bounding box
+    file.write(ob.bbox)
+
+    # ZONE
+    if ob.type == 0x04: return
+    # PORTAL
+    if ob.type == 0x08:
         write_long(file,len(ob.verts))
-        for key in ob.verts:
-            file.write(key[0:12])
-            if ob.numUVs == 2:
-                write_float(file,0)
-                file.write(key[24:40])
-            else:
-                file.write(key[12:32])
-        # normals if 2-ch
-        if ob.numUVs == 2:
-            write_long(file,len(ob.verts)) # normals
-            for key in ob.verts:
-                file.write(key[12:24])
-        else:
-            write_long(file,0) # normals        
-        # tangents
-        write_long(file,0)
+        file.write(ob.verts['pos'].tobytes())
+        return
+
+    # transform matrix
+    dummy = struct.pack('<16f', 1,0,0,0, 0,1,0,0, 0,0,1,0, 0,0,0,1)
+    file.write(dummy)
+
+    # 0x0
+    write_long(file,0)
+
+    # materials
+    mtl_idx = int(ob.mtls[0,1])
+    mtl = ob.materials[mtl_idx]
+    # light map : 2nd UV-channel
+    texName = mtl.get('light')
+    if texName is None: texName = fname(ob.lm)
+    write_long(file,len(texName)+1)
+    writeString(file,texName)
+    texName = 'notex'
+    write_long(file,len(texName)+1)
+    writeString(file,texName)
+    # colorMaps
+    mtl_offset = 0
+    num_mtls = len(ob.mtls)
+    write_long(file,num_mtls)
+    for i in range(num_mtls):
+        mtl_len, mtl_idx = ob.mtls[i].tolist()
+        mtl = ob.materials[mtl_idx]
+        # color map : 1st UV-channel
+        texName = mtl.get('color')
+        write_long(file,len(texName)+1)
+        writeString(file,texName)   # color
+        write_long(file,mtl_offset) # offset
+        write_long(file,mtl_len)    # size
+        mtl_offset += mtl_len * 3
+
+    # faces
+    write_long(file,len(ob.faces)*3)
+    file.write(ob.faces[:,[0,2,1]].astype('<u2').tobytes())
+    write_long(file,0)        
+    # verts
+    write_long(file,len(ob.verts))
+    if ob.numUVs == 2:
+        file.write(packVerts(ob.verts, 'pos', None, 'uv0', 'uv1'))
+    else:
+        file.write(packVerts(ob.verts, 'pos', 'normal', 'uv0'))
+    # normals if 2-ch
+    if ob.numUVs == 2:
+        write_long(file,len(ob.verts)) # normals
+        file.write(ob.verts['normal'].tobytes())
+    else:
+        write_long(file,0) # normals        
+    # tangents
+    write_long(file,0)
 
 
 def save_dat(file, context, global_matrix, params):
-    data = getGeometry(file, context, global_matrix, params)
-    dumpDAT(file, data)
+    dumpDAT(file, getGeometry(file, context, global_matrix, params))
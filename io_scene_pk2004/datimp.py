@@ -1,197 +1,179 @@
 from .common import *
 
 
-def load_dat(file):
-    geometry = CacheMeshDAT(file)
-    mtl_cache = {}
-    image_cache = {}    
-    for geom in geometry: BuildMesh(geom)
+def load_dat(file, budget=0):
+    # one object at a time : decode, build, drop ; decoding runs a few
+    # objects ahead of the build, on a background thread
+    for geom in prefetch(CacheMeshDAT(file), budget):
+        with perf.phase('build'):
+            BuildMesh(geom)
+        geom = None # built, release
 
 
-def CacheMeshDAT(file):
+def blank(numVerts):
+    # normals, uv0, uv1 of the helper objects
+    return (np.zeros((numVerts,3), dtype=np.float32),
+            np.zeros((numVerts,2), dtype=np.float32),
+            np.zeros((numVerts,2), dtype=np.float32))
+
+
+def IndexDAT(file):
+    # names, types, sizes & offsets : nothing is decoded
     file.seek(0, io.SEEK_SET)
     namelist = []
     for i in range(read_long(file)):
         namelist.append(readString(file))
 
-    numobj = read_long(file)
-    geometry = []
-    for i in range(numobj):
-        geometry.append(MeshIn('', 0, 0, [], 0, [], 0, [], '', 0x02, 0, 0, 0))
+    index = []
+    for i in range(read_long(file)):
         temp = read_long(file) # 0x0
-        geometry[i].type = read_long(file)
-        index = read_long(file)
-        geometry[i].index = index
-        geometry[i].meshname = namelist[index]
-        geometry[i].size = read_long(file)
-        geometry[i].offset = read_long(file)
-
-    for i in range(numobj):
-        file.seek(geometry[i].offset, io.SEEK_SET)
-        if geometry[i].index == 0:
-            geometry[i].meshname = readString(file)
-            """
-            ---------------------------
-            |       type | item | map |
-            ---------------------------
-            | renderable | 0x02 |  1  |
-            |       zone | 0x04 |  2  |
-            |     portal | 0x08 |  3  |
-            |      antyp | 0x10 |  4  |
-            ---------------------------
-            """
-            geometry[i].type = 1 << geometry[i].type
-        else:
-            readString(file)
-
-        if geometry[i].type == 0x02:
-            geometry[i].numchannels = 1 if read_long(file) & 0x0400 else 2
-
-        # ANTYP : never appears in any original file
-        if geometry[i].type == 0x10:
-            dummyMat(geometry[i])
-            geometry[i].numchannels = 1
-            
-            geometry[i].numVerts = read_long(file)
-            for ii in range(geometry[i].numVerts):
-                pt = pkspc @ mathutils.Vector((read_float(file),read_float(file),read_float(file)))
-                geometry[i].verts.append(Vertex(pt.x, pt.y, pt.z, 0,0,0,0,0,0,0))
-
-            geometry[i].numFaces = int(read_long(file) / 3)
-            for ii in range(geometry[i].numFaces):
-                v0, v1, v2 = read_short(file), read_short(file), read_short(file)
-                geometry[i].faces.append(Face(v0, v2, v1))
-            continue
-
-        # bounding box
-        bbox = [
-            pkspc @ mathutils.Vector((read_float(file),read_float(file),read_float(file))),
-            pkspc @ mathutils.Vector((read_float(file),read_float(file),read_float(file))),
-            ]
-
-        # ZONE
-        if geometry[i].type == 0x04:
-            dummyMat(geometry[i])
-            geometry[i].numchannels = 1
-
-            geometry[i].numVerts = 8
-
-            for ii in range(geometry[i].numVerts):
-                geometry[i].verts.append(Vertex(
-                bbox[int(ii>>0&1)].x, bbox[int(ii>>1&1)].y, bbox[int(ii>>2&1)].z,
-                0,0,0,0,0,0,0))
-
-            geometry[i].numFaces = 12
-
-            geometry[i].faces.append(Face(3,0,1))
-            geometry[i].faces.append(Face(0,3,2))
-            geometry[i].faces.append(Face(7,2,3))
-            geometry[i].faces.append(Face(2,7,6))
-            geometry[i].faces.append(Face(5,6,7))
-            geometry[i].faces.append(Face(6,5,4))
-            geometry[i].faces.append(Face(1,4,5))
-            geometry[i].faces.append(Face(4,1,0))
-
-            geometry[i].faces.append(Face(6,0,2))
-            geometry[i].faces.append(Face(0,6,4))
-            geometry[i].faces.append(Face(5,3,1))
-            geometry[i].faces.append(Face(3,5,7))
-
-            continue
-
-        # PORTAL
-        if geometry[i].type == 0x08:
-            dummyMat(geometry[i])
-            geometry[i].numchannels = 1
-
-            geometry[i].numVerts = read_long(file)
-
-            geometry[i].numFaces = 2
-            if geometry[i].numVerts == 4:
-                geometry[i].faces.append(Face(2, 1, 0))
-                geometry[i].faces.append(Face(0, 3, 2))
-            else:
-                geometry[i].faces.append(Face(0, 1, 2))
-                geometry[i].faces.append(Face(3, 4, 5))
-            
-            for ii in range(geometry[i].numVerts):
-                pt = pkspc @ mathutils.Vector((read_float(file),read_float(file),read_float(file)))
-                vert = Vertex(pt.x, pt.y, pt.z, 0,0,0,0,0,0,0)
-                geometry[i].verts.append(vert)
-            continue
-
-        # matrix
-        file.seek(64, io.SEEK_CUR)
-
-        # dead
-        readString(file) # 0x0
-
-        # materials
-        lightmap = Path(readString(file)).stem
-        notex = readString(file)
-        geometry[i].nummat = read_long(file)
-        for ii in range(geometry[i].nummat):
-            colormap = Path(readString(file)).stem
-            offset = read_long(file)
-            size = read_long(file)
-            mat = Material(offset, size,
-                colormap, UV(0, 0), UV(1, 1),
-                lightmap, UV(0, 0), UV(1, 1),
-                '', UV(0, 0), UV(1, 1),
-                '', UV(0, 0), UV(1, 1),
-            )
-            geometry[i].mat.append(mat)
-
-        # dummy material
-        if geometry[i].nummat == 0: dummyMat(geometry[i])
-
-        # faces
-        num_verts = read_long(file)
-        if (num_verts % 3) == 0:
-            geometry[i].numFaces = int(num_verts / 3)
-            for ii in range(geometry[i].numFaces):
-                v0, v1, v2 = read_short(file), read_short(file), read_short(file)
-                geometry[i].faces.append(Face(v0, v2, v1))
+        type = read_long(file)
+        idx = read_long(file)
+        index.append(SimpleNamespace(type=type, index=idx, meshname=namelist[idx], size=read_long(file), offset=read_long(file)))
+    return index
+
+
+def CacheMeshDAT(file):
+    # generator : decodes the next object only when asked for it
+    with perf.phase('parse'):
+        index = IndexDAT(file)
+    for entry in index:
+        with perf.phase('parse'):
+            geom = CacheObjectDAT(file, entry)
+        yield geom
+        geom = None
+
+
+def CacheObjectDAT(file, entry):
+    geom = MeshIn(meshname=entry.meshname, type=entry.type, index=entry.index, size=entry.size, offset=entry.offset)
+    file.seek(geom.offset, io.SEEK_SET)
+    if geom.index == 0:
+        geom.meshname = readString(file)
+        """
+        ---------------------------
+        |       type | item | map |
+        ---------------------------
+        | renderable | 0x02 |  1  |
+        |       zone | 0x04 |  2  |
+        |     portal | 0x08 |  3  |
+        |      antyp | 0x10 |  4  |
+        ---------------------------
+        """
+        geom.type = 1 << geom.type
+    else:
+        readString(file)
+
+    if geom.type == 0x02:
+        geom.numchannels = 1 if read_long(file) & 0x0400 else 2
+
+    # ANTYP : never appears in any original file
+    if geom.type == 0x10:
+        dummyMat(geom)
+        geom.numchannels = 1
+        
+        numVerts = read_long(file)
+        geom.co = pk2bl(np.frombuffer(file.read(numVerts*12), dtype='<f4').reshape(-1,3))
+        geom.normals, geom.uv0, geom.uv1 = blank(numVerts)
+
+        numFaces = int(read_long(file) / 3)
+        faces = np.frombuffer(file.read(numFaces*6), dtype='<u2').reshape(-1,3)
+        geom.faces = faces[:,[0,2,1]].astype(np.uint32)
+        return geom
+
+    # bounding box
+    bbox = pk2bl(np.frombuffer(file.read(24), dtype='<f4').reshape(2,3))
+
+    # ZONE
+    if geom.type == 0x04:
+        dummyMat(geom)
+        geom.numchannels = 1
+
+        corners = np.arange(8)
+        geom.co = np.stack((
+            bbox[corners>>0&1, 0], bbox[corners>>1&1, 1], bbox[corners>>2&1, 2]), axis=-1)
+        geom.normals, geom.uv0, geom.uv1 = blank(8)
+
+        geom.faces = np.array((
+            (3,0,1), (0,3,2), (7,2,3), (2,7,6), (5,6,7), (6,5,4), (1,4,5), (4,1,0),
+            (6,0,2), (0,6,4), (5,3,1), (3,5,7),
+            ), dtype=np.uint32)
+
+        return geom
+
+    # PORTAL
+    if geom.type == 0x08:
+        dummyMat(geom)
+        geom.numchannels = 1
+
+        numVerts = read_long(file)
+
+        if numVerts == 4:
+            geom.faces = np.array(((2,1,0), (0,3,2)), dtype=np.uint32)
         else:
-            file.seek(SZ_SHORT*num_verts, io.SEEK_CUR)
-        read_triangle_strip(file,geometry[i])
-
-        # vertices
-        geometry[i].numVerts = read_long(file)
-        for ii in range(geometry[i].numVerts):
-            vert = Vertex(0, 0, 0, 0, 0, 0, 0, 0, 0, 0)
-            vert.x = read_float(file)
-            vert.z = read_float(file)
-            vert.y = -read_float(file)
-
-            if geometry[i].numchannels == 2:
-                file.seek(4, io.SEEK_CUR) # 0x0
-                vert.u = read_float(file)
-                vert.v = 1 - read_float(file)
-                vert.u2 = read_float(file)
-                vert.v2 = 1 - read_float(file)
-            else:
-                vert.nx = read_float(file)
-                vert.nz = read_float(file)
-                vert.ny = -read_float(file)
-                vert.u = read_float(file)
-                vert.v = 1 - read_float(file)
-            geometry[i].verts.append(vert)
-        # normals if 2-ch
-        nrmls = read_long(file)
-        for ii in range(nrmls):
-            geometry[i].verts[ii].nx = read_float(file)
-            geometry[i].verts[ii].nz = read_float(file)
-            geometry[i].verts[ii].ny = -read_float(file)
-
-        # vertex index out of range fix (2domCALY.dat)
-        for ii in range(geometry[i].numFaces):
-            face = geometry[i].faces[ii]
-            if face.v0 > geometry[i].numVerts: face.v0 = 0
-            if face.v1 > geometry[i].numVerts: face.v1 = 0
-            if face.v2 > geometry[i].numVerts: face.v2 = 0
-
-        # tangents
-        file.seek(read_long(file)*8*SZ_FLOAT, io.SEEK_CUR)
-
-    return geometry
\ No newline at end of file
+            geom.faces = np.array(((0,1,2), (3,4,5)), dtype=np.uint32)
+        
+        geom.co = pk2bl(np.frombuffer(file.read(numVerts*12), dtype='<f4').reshape(-1,3))
+        geom.normals, geom.uv0, geom.uv1 = blank(numVerts)
+        return geom
+
+    # matrix
+    file.seek(64, io.SEEK_CUR)
+
+    # dead
+    readString(file) # 0x0
+
+    # materials
+    lightmap = Path(readString(file)).stem
+    notex = readString(file)
+    for ii in range(read_long(file)):
+        colormap = Path(readString(file)).stem
+        offset = read_long(file)
+        size = read_long(file)
+        mat = Material(offset, size,
+            colormap, UV(0, 0), UV(1, 1),
+            lightmap, UV(0, 0), UV(1, 1),
+            '', UV(0, 0), UV(1, 1),
+            '', UV(0, 0), UV(1, 1),
+        )
+        geom.mat.append(mat)
+
+    # dummy material
+    if geom.nummat == 0: dummyMat(geom)
+
+    # faces : v0,v2,v1
+    num_verts = read_long(file)
+    if (num_verts % 3) == 0:
+        faces = np.frombuffer(file.read(num_verts*SZ_SHORT), dtype='<u2').reshape(-1,3)
+        geom.faces = faces[:,[0,2,1]].astype(np.uint32)
+    else:
+        file.seek(SZ_SHORT*num_verts, io.SEEK_CUR)
+    read_triangle_strip(file,geom)
+
+    # vertices
+    numVerts = read_long(file)
+    data = np.frombuffer(file.read(numVerts*32), dtype='<f4').reshape(-1,8)
+    if geom.numchannels == 2:
+        # x,z,-y, 0x0, u,v, u2,v2
+        geom.co = pk2bl(data[:,0:3])
+        geom.normals = np.zeros((numVerts,3), dtype=np.float32)
+        geom.uv0 = flipv(data[:,4:6])
+        geom.uv1 = flipv(data[:,6:8])
+    else:
+        # x,z,-y, nx,nz,-ny, u,v
+        geom.co = pk2bl(data[:,0:3])
+        geom.normals = pk2bl(data[:,3:6])
+        geom.uv0 = flipv(data[:,6:8])
+        geom.uv1 = np.zeros((numVerts,2), dtype=np.float32)
+    # normals if 2-ch
+    nrmls = read_long(file)
+    if nrmls:
+        data = np.frombuffer(file.read(nrmls*12), dtype='<f4').reshape(-1,3)
+        geom.normals[:nrmls] = pk2bl(data)
+
+    # vertex index out of range fix (2domCALY.dat)
+    geom.faces[geom.faces > numVerts] = 0
+
+    # tangents
+    file.seek(read_long(file)*8*SZ_FLOAT, io.SEEK_CUR)
+
+    return geom
@@ -8,7 +8,88 @@ def strToBytes(name):
     return out
 
 
-def save_mdl(file, context, global_matrix, params):
+def packWeights(weights):
+    # per vertex: <i count, then count * (<H bone, <f weight)
+    counts = weights.counts
+    influence = np.empty(len(weights.weight), dtype=[('bone','<u2'),('weight','<f4')])
+    influence['bone'] = weights.bone_idx
+    influence['weight'] = weights.weight
+    buf = np.empty(SZ_INT*len(counts) + influence.itemsize*len(influence), dtype=np.uint8)
+    first = np.cumsum(counts) - counts # first influence of each vertex
+    head = SZ_INT*np.arange(len(counts)) + influence.itemsize*first
+    buf[head[:,None] + np.arange(SZ_INT)] = counts.astype('<i4').view(np.uint8).reshape(-1,SZ_INT)
+    vert = np.repeat(np.arange(len(counts)), counts)
+    body = SZ_INT*(vert+1) + influence.itemsize*np.arange(len(influence))
+    buf[body[:,None] + np.arange(influence.itemsize)] = influence.view(np.uint8).reshape(-1,influence.itemsize)
+    return buf.tobytes()
+
+
+def LimitWeights(weights, max_influences=4, epsilon=0.001):
+    # keep the strongest 'max_influences' (0 : all) influences >= 'epsilon' per vertex and renormalize
+    counts = weights.counts
+    vert = np.repeat(np.arange(len(counts)), counts)
+    order = np.lexsort((-weights.weight, vert)) # strongest first
+    first = np.cumsum(counts) - counts
+    rank = np.empty(len(order), dtype=np.int64)
+    rank[order] = np.arange(len(order)) - first[vert]
+    keep = weights.weight >= epsilon
+    if max_influences > 0: keep &= rank < max_influences
+    keep |= rank == 0 # never leave a vertex unweighted
+    vert = vert[keep]
+    weight = weights.weight[keep]
+    total = np.bincount(vert, weights=weight, minlength=len(counts))
+    kept = np.bincount(vert, minlength=len(counts))
+    # all kept influences at 0 : share the vertex evenly
+    safe = np.where(total > 0, total, 1)
+    weight = np.where(total[vert] > 0, weight / safe[vert], 1.0 / kept[vert])
+    limited = SimpleNamespace(
+        counts  = kept.astype(np.int32),
+        bone_idx= weights.bone_idx[keep],
+        weight  = weight.astype(np.float32),
+    )
+    trimmed = int(np.count_nonzero(limited.counts != counts))
+    return limited, trimmed
+
+
+def dumpMDLobject(file, ob):
+    out = bytearray()
+    # name
+    out += strToBytes(ob.name + '\x00')
+    # MATERIALS
+    out += struct.pack('<2I', 0, 0)
+    # normal
+    texName = ob.materials[0].get('PBimg')
+    if len(ob.mtls)==1 and len(texName): out += strToBytes(texName + '\x00')
+    else: out += struct.pack('<I', 0)
+    # colors
+    mtl_offset = 0
+    num_mtls = len(ob.mtls)
+    out += struct.pack('<I', num_mtls)
+    for i in range(num_mtls):
+        mtl_len, mtl_idx = ob.mtls[i].tolist()
+        mtl = ob.materials[mtl_idx]
+        texName = mtl.get('color')
+        out += strToBytes(texName + '\x00')  # color
+        out += struct.pack('<I', mtl_offset) # offset
+        out += struct.pack('<I', mtl_len)    # size
+        mtl_offset += mtl_len * 3
+    # faces
+    out += struct.pack('<I', 3*len(ob.faces))
+    out += ob.faces.astype('<u2').tobytes()
+    # triangle strip
+    out += struct.pack('<I', 0)
+    # vertices
+    out += struct.pack('<I', len(ob.verts))
+    out += packVerts(ob.verts, 'pos', 'normal', 'uv0')
+    # tangents
+    out += struct.pack('<2I', 0, 0)
+    # skinning
+    out += struct.pack('<I', len(ob.weights.counts))
+    out += packWeights(ob.weights)
+    file.write(out)
+
+
+def save_mdl(file, context, global_matrix, params, limits=(4, 0.001)):
 
     try: arm_obj=[obj for obj in context.scene.objects if obj.type == 'ARMATURE'][0]
     except:
@@ -38,49 +119,25 @@ def save_mdl(file, context, global_matrix, params):
         # numchildren
         out += struct.pack('B', (0,len(bone.children))[bool(bone.children)])
 
+    # geometries are serialized as they are converted, the count is patched in afterwards
+    numgeom = 0
+    count_at = len(out)
+    out += struct.pack('<I', 0)
+    max_influences, epsilon = limits
     arm_obj.data.pose_position = 'REST'
-    data = getGeometry(file, context, global_matrix, params + (arm_obj,))
-    arm_obj.data.pose_position = 'POSE'
-    out += struct.pack('<I', len(data.geom))
-    for ob in data.geom:
-        # name
-        out += strToBytes(ob.name + '\x00')
-        # MATERIALS
-        out += struct.pack('<2I', 0, 0)
-        # normal
-        texName = ob.materials[0].get('PBimg')
-        if len(ob.mtls)==1 and len(texName): out += strToBytes(texName + '\x00')
-        else: out += struct.pack('<I', 0)
-        # colors
-        mtl_offset = 0
-        num_mtls = len(ob.mtls)
-        out += struct.pack('<I', num_mtls)
-        for i in range(num_mtls):
-            mtl_len = ob.mtls.get(i)[0]
-            mtl_idx = ob.mtls.get(i)[1]
-            mtl = ob.materials[mtl_idx]
-            texName = mtl.get('color')
-            out += strToBytes(texName + '\x00')  # color
-            out += struct.pack('<I', mtl_offset) # offset
-            out += struct.pack('<I', mtl_len)    # size
-            mtl_offset += mtl_len * 3
-        # faces
-        out += struct.pack('<I', 3*len(ob.faces))
-        for f in ob.faces: out += struct.pack('<3H', f[0],f[1],f[2])
-        # triangle strip
-        out += struct.pack('<I', 0)
-        # vertices
-        out += struct.pack('<I', len(ob.verts))
-        for key in ob.verts: out += key[0:32]
-        # tangents
-        out += struct.pack('<2I', 0, 0)
-        # skinning
-        out += struct.pack('<I', len(ob.weights))
-        for influences in ob.weights:
-            out += struct.pack('<i', len(influences))
-            for influence in influences:
-                out += struct.pack('<H', influence.bone_idx)
-                out += struct.pack('<f', influence.weight)
+    try:
+        for ob in getGeometry(file, context, global_matrix, params + (arm_obj, limits)):
+            notes = []
+            if not isinstance(ob, Chunk):
+                with perf.phase('limit_weights'):
+                    ob.weights, trimmed = LimitWeights(ob.weights, max_influences, epsilon)
+                if trimmed: notes.append(('\'%s\' : influences dropped on %d vertices%s' % (ob.name, trimmed, ('', ' (max %d)' % max_influences)[max_influences > 0]), 'INFO'))
+            numgeom += 1
+            out += ObjectChunk(ob, dumpMDLobject, notes=notes).data
+    finally:
+        arm_obj.data.pose_position = 'POSE'
+    out[count_at:count_at+4] = struct.pack('<I', numgeom)
+
     skins = []
     skins.append(strToBytes(skinname + '.pkmdl' + '\x00'))
     skins.append(out)
@@ -106,13 +163,132 @@ def save_mdl(file, context, global_matrix, params):
         head += struct.pack('<I', len(skin)) # size
         head += struct.pack('<I', offset)    # offset
         offset += len(skin)
-    file.write(head)
-    for i,skin in enumerate(skins):
-        if i in (0,2): continue
-        file.write(skin)
+    with perf.phase('write'):
+        file.write(head)
+        for i,skin in enumerate(skins):
+            if i in (0,2): continue
+            file.write(skin)
+
+
+def _slerp(q0, q1, t):
+    # q0, q1 : (4,) ; t : (n,1)
+    dot = np.clip(q0 @ q1, -1.0, 1.0)
+    if dot > 0.9995:
+        q = q0 + (q1 - q0)*t
+        return q / np.linalg.norm(q, axis=1)[:,None]
+    theta = np.arccos(dot)
+    return (np.sin((1-t)*theta)*q0 + np.sin(t*theta)*q1) / np.sin(theta)
+
+
+def ReduceKeys(keys, pos_tol, rot_tol):
+    # indices of the keys required to rebuild every other key
+    # by interpolating its neighbours within the tolerances
+    n = len(keys)
+    if n < 3: return list(range(n))
+    loc = np.empty((n,3)); rot = np.empty((n,4)); scl = np.empty((n,3))
+    for k,mtx in enumerate(keys):
+        loc[k],rot[k],scl[k] = mtx.decompose()
+    # keep quaternions in one hemisphere
+    dots = np.einsum('ij,ij->i', rot[1:], rot[:-1])
+    rot[1:] *= np.cumprod(np.where(dots < 0, -1.0, 1.0))[:,None]
+
+    def fits(i, j):
+        t = ((np.arange(i+1, j) - i) / (j - i))[:,None]
+        if np.linalg.norm(loc[i] + (loc[j]-loc[i])*t - loc[i+1:j], axis=1).max() > pos_tol: return False
+        if np.linalg.norm(scl[i] + (scl[j]-scl[i])*t - scl[i+1:j], axis=1).max() > pos_tol: return False
+        dot = np.abs(np.einsum('ij,ij->i', _slerp(rot[i], rot[j], t), rot[i+1:j]))
+        return 2*np.arccos(np.clip(dot, 0.0, 1.0)).max() <= rot_tol
+
+    kept = [0]
+    for j in range(2, n):
+        if not fits(kept[-1], j): kept.append(j-1)
+    kept.append(n-1)
+    return kept
+
+
+def getActions(arm_obj):
+    # (action, slot, frame range) of the active action and of every NLA strip
+    clips = []
+    anim_data = arm_obj.animation_data
+    if anim_data is None: return clips
+    if anim_data.action:
+        clips.append((anim_data.action, getattr(anim_data, 'action_slot', None), anim_data.action.frame_range))
+    for track in anim_data.nla_tracks:
+        for strip in track.strips:
+            if strip.action is None or strip.action in [clip[0] for clip in clips]: continue
+            frame_range = (strip.action_frame_start, strip.action_frame_end)
+            clips.append((strip.action, getattr(strip, 'action_slot', None), frame_range))
+    return clips
+
+
+def AniRest(arm_obj):
+    # parent space rest matrices
+    REST = {}
+    for pbone in arm_obj.pose.bones:
+        rest = pbone.bone.matrix_local
+        if pbone.parent: rest = pbone.parent.bone.matrix_local.inverted() @ rest
+        REST[pbone.name] = rest
+    return REST
+
+
+def SampleAction(arm_obj, fcurves, frames):
+    # 'matrix_basis' of every bone at every frame
+    BONES = {pbone.name: [] for pbone in arm_obj.pose.bones}
+    for frame in frames:
+        fcurve_cache = {}
+        for fcurve in fcurves:
+            value = fcurve.evaluate(frame)
+            path  = fcurve.data_path
+            if path not in fcurve_cache: fcurve_cache[path] = []
+            fcurve_cache[path].append(value)
+
+        for pbone in arm_obj.pose.bones:
+            loc_path   = f'pose.bones["{pbone.name}"].location'
+            rot_q_path = f'pose.bones["{pbone.name}"].rotation_quaternion'
+            scale_path = f'pose.bones["{pbone.name}"].scale'
+            try:
+                loc = mathutils.Vector((v for v in fcurve_cache[loc_path]))
+                rot = mathutils.Quaternion((v for v in fcurve_cache[rot_q_path]))
+                scl = mathutils.Vector((v for v in fcurve_cache[scale_path]))
+                mtx = mathutils.Matrix.LocRotScale(loc,rot,scl)
+            except:
+                mtx = mathutils.Matrix.Identity(4)
+            BONES[pbone.name].append(mtx)
+    return BONES
+
+
+def PackAni(REST, BONES, numframes, fps, reduce=None):
+    # parent space keys
+    KEYS = {name: [REST[name] @ matrix_basis for matrix_basis in BONES[name]] for name in BONES}
+
+    # per bone key selection
+    FRAMES = {}
+    for name in KEYS:
+        if reduce: FRAMES[name] = ReduceKeys(KEYS[name], *reduce)
+        else: FRAMES[name] = range(numframes)
+    if reduce and len(set(len(f) for f in FRAMES.values())) == 1:
+        # keep the frame rate recoverable from the key counts
+        FRAMES[next(iter(FRAMES))] = range(numframes)
+
+    out = bytearray(b'skel') # magic_bytes
+    duration = numframes / fps
+    numbones = len(KEYS)
+    out += struct.pack('<fI', duration, numbones)
+    for name in KEYS:
+        out += strToBytes(name)
+        out += struct.pack('<I', len(FRAMES[name]))
+        for frame in FRAMES[name]:
+            # timestamp
+            out += struct.pack('<f', frame * duration / numframes)
+            # key
+            mtx = KEYS[name][frame]
+            mtx = pkspc.inverted() @ mtx.transposed() @ pkspc.inverted().transposed()
+            flat = [item for row in mtx for item in row]
+            out += struct.pack('16f', *flat)
+    return out
 
 
-def save_ani(file, context):
+def save_ani(file, context, reduce=None):
 
     try: arm_obj=[obj for obj in context.scene.objects if obj.type == 'ARMATURE'][0]
     except:
@@ -121,61 +297,54 @@ def save_ani(file, context):
 
     fcurves = None
     anim_data = arm_obj.animation_data
-    try:     # blender 4
-        fcurves = arm_obj.animation_data.action.fcurves
-    except Exception:
-        try: # blender 5
-            channelbag = anim_utils.action_get_channelbag_for_slot(anim_data.action, anim_data.action_slot)
-            fcurves = channelbag.fcurves
-        except: pass
-
-    BONES = {}
+    if anim_data and anim_data.action:
+        fcurves = getFCurves(anim_data.action, getattr(anim_data, 'action_slot', None))
+
     if fcurves:
         numframes = 1+context.scene.frame_end-context.scene.frame_start
-        for frame in range(numframes):
-            fcurve_cache = {}
-            for fcurve in fcurves:
-                value = fcurve.evaluate(frame)
-                path  = fcurve.data_path
-                if path not in fcurve_cache: fcurve_cache[path] = []
-                fcurve_cache[path].append(value)
-
-            for pbone in arm_obj.pose.bones:
-                loc_path   = f'pose.bones["{pbone.name}"].location'
-                rot_q_path = f'pose.bones["{pbone.name}"].rotation_quaternion'
-                scale_path = f'pose.bones["{pbone.name}"].scale'
-                try:
-                    loc = mathutils.Vector((v for v in fcurve_cache[loc_path]))
-                    rot = mathutils.Quaternion((v for v in fcurve_cache[rot_q_path]))
-                    scl = mathutils.Vector((v for v in fcurve_cache[scale_path]))
-                    mtx = mathutils.Matrix.LocRotScale(loc,rot,scl)
-                except:
-                    mtx = mathutils.Matrix.Identity(4)
-                if pbone.name not in BONES: BONES[pbone.name] = []
-                BONES[pbone.name].append(mtx)
+        with perf.phase('sample'):
+            BONES = SampleAction(arm_obj, fcurves, range(numframes))
     else: # dummy animation of two frames (rest pose)
         numframes = 2
-        for frame in range(numframes):
-            for pbone in arm_obj.pose.bones:
-                if pbone.name not in BONES: BONES[pbone.name] = []
-                BONES[pbone.name].append(mathutils.Matrix.Identity(4))
+        BONES = {pbone.name: [mathutils.Matrix.Identity(4)]*numframes for pbone in arm_obj.pose.bones}
 
-    out = bytearray(b'skel') # magic_bytes
-    duration = numframes / context.scene.render.fps
-    numbones = len(arm_obj.data.bones)
-    out += struct.pack('<fI', duration, numbones)
-    for pbone in arm_obj.pose.bones:
-        out += strToBytes(pbone.name)
-        out += struct.pack('<I', numframes)
-        for frame in range(numframes):
-            # timestamp
-            out += struct.pack('<f', frame * duration / numframes)
-            # key
-            matrix_basis = BONES[pbone.name][frame]
-            mtx = pbone.bone.matrix_local
-            if pbone.parent: mtx = pbone.parent.bone.matrix_local.inverted() @ mtx
-            mtx = mtx @ matrix_basis
-            mtx = pkspc.inverted() @ mtx.transposed() @ pkspc.inverted().transposed()
-            flat = [item for row in mtx for item in row]
-            out += struct.pack('16f', *flat)
-    file.write(out)
\ No newline at end of file
+    with perf.phase('write'):
+        file.write(PackAni(AniRest(arm_obj), BONES, numframes, context.scene.render.fps, reduce))
+
+
+def save_anis(dirname, context, reduce=None):
+
+    try: arm_obj=[obj for obj in context.scene.objects if obj.type == 'ARMATURE'][0]
+    except:
+        info('No armature found', icon='WARNING')
+        return 0
+
+    REST = AniRest(arm_obj)
+    fps = context.scene.render.fps
+
+    # sample on the main thread
+    jobs = []
+    names = set()
+    for action,slot,(start,end) in getActions(arm_obj):
+        fcurves = getFCurves(action, slot)
+        if not fcurves: continue
+        frames = range(int(start), int(end)+1)
+        # actions cleaned to the same file name ('Run.L', 'Run_L') : numbered
+        name = clean = bpy.path.clean_name(action.name)
+        n = 1
+        while name.lower() in names:
+            name = '%s_%d' % (clean, n); n += 1
+        if name != clean: info('\'%s\' exported as \'%s.ani\' : \'%s.ani\' is taken' % (action.name, name, clean), icon='WARNING')
+        names.add(name.lower())
+        filepath = os.path.join(dirname, name + '.ani')
+        with perf.phase('sample'):
+            jobs.append((filepath, SampleAction(arm_obj, fcurves, frames), len(frames)))
+
+    # pack & write in parallel
+    def write(job):
+        filepath, BONES, numframes = job
+        data = PackAni(REST, BONES, numframes, fps, reduce)
+        with open(filepath, 'wb') as file: file.write(data)
+    with perf.phase('write'), ThreadPoolExecutor() as pool:
+        list(pool.map(write, jobs))
+    return len(jobs)
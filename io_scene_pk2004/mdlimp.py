@@ -12,7 +12,8 @@ class Skin:
     offset   : int
 
 
-def CachePKMDL(file):
+def IndexPKMDL(file):
+    # skin names, types, sizes & offsets : nothing is decoded
     file.seek(0, io.SEEK_SET)
     namelist = []
     for i in range(read_long(file)): namelist.append(readString(file))
@@ -33,76 +34,103 @@ def CachePKMDL(file):
         if model[i].index == 0:
             model[i].skinname = readString(file)
             model[i].type = 1 << model[i].type
-        else:
-            readString(file)
         model[i].skinname = os.path.basename(model[i].skinname).split('.', 1)[0]
-        # skeleton
-        numskels = read_short(file)
-        numbones = read_long(file)
-        currparent = -1
-        for ii in range(numbones):
-            bonename = readString(file)
-            data = struct.unpack('<16f', file.read(64))
-            mtx=mathutils.Matrix((data[0:4],data[4:8],data[8:12],data[12:16]))
-            try: model[i].skel[currparent].numchildren-=1
-            except: pass
-            numchildren = file.read(1)[0]
-            model[i].skel.append(
-                SimpleNamespace(name=bonename,tm=mtx,numchildren=numchildren,parent=currparent)
-                )
-            currparent=ii
-            if model[i].skel[ii].numchildren==0:
-                while currparent>=0 and model[i].skel[currparent].numchildren==0: currparent-=1
-        # mesh objects
-        for ii in range(read_long(file)):
-            geom = MeshIn('', 1, 0, [], 0, [], 0, [], '', 0x02, 0, 0, 0)
-            geom.meshname = readString(file)
-            # materials
-            readString(file) # dead
-            readString(file) # dead
-            geom.normalmap = readString(file)
-            nummat = read_long(file)
-            geom.nummat = nummat
-            for iii in range(nummat):
-                colormap = os.path.basename(readString(file)).split('.', 1)[0]
-                lightmap = ''
-                offset   = read_long(file)
-                size     = read_long(file)
-                mat = Material(offset, size,
-                    colormap, UV(0, 0), UV(1, 1),
-                    lightmap, UV(0, 0), UV(1, 1),
-                    '', UV(0, 0), UV(1, 1),
-                    '', UV(0, 0), UV(1, 1),
-                )
-                geom.mat.append(mat)
-            # faces
-            geom.numFaces = int(read_long(file)/3)
-            for iii in range(geom.numFaces):
-                v0,v1,v2 = read_short(file), read_short(file), read_short(file)
-                geom.faces.append(Face(v0,v1,v2))
-            read_triangle_strip(file,geom)
-            # vertices
-            geom.numVerts = read_long(file)
-            for iii in range(geom.numVerts):
-                data = file.read(32)
-                x,z,y,nx,nz,ny,u,v = struct.unpack('<8f', data)
-                geom.verts.append(Vertex(x,-y,z,nx,-ny,nz,u,1-v,0,0))
-            file.seek(read_long(file)*3*SZ_FLOAT, io.SEEK_CUR)
-            file.seek(read_long(file)*8*SZ_FLOAT, io.SEEK_CUR)
-            # skinning
-            geom.weights = []
-            numVerts = read_long(file)
-            for iii in range(numVerts):
-                influences = []
-                for iiii in range(read_long(file)):
-                    influences.append(
-                        SimpleNamespace(bone_idx=read_short(file),weight=read_float(file))
-                    )
-                geom.weights.append(influences)
-            model[i].geometry.append(geom)
     return model
 
 
+def CachePKMDL(file, skinnames=None):
+    # decode the requested skins only (None : all)
+    model = IndexPKMDL(file)
+    if skinnames is not None:
+        model = [skin for skin in model if skin.skinname in skinnames]
+    for skin in model: CacheSkin(file, skin)
+    return model
+
+
+def CacheSkin(file, skin):
+    CacheSkeleton(file, skin)
+    skin.geometry = list(CacheSkinMeshes(file))
+
+
+def CacheSkeleton(file, skin):
+    file.seek(skin.offset, io.SEEK_SET)
+    readString(file)
+    # skeleton : depth-first, parent indices & local matrices
+    numskels = read_short(file)
+    numbones = read_long(file)
+    skel = SimpleNamespace(
+        names  =[],
+        parents=np.empty(numbones, dtype=np.int32),
+        tms    =np.empty((numbones,4,4), dtype=np.float32),
+        )
+    stack = [] # [bone, children left]
+    for ii in range(numbones):
+        skel.names.append(readString(file))
+        skel.tms[ii] = np.frombuffer(file.read(64), dtype='<f4').reshape(4,4)
+        numchildren = file.read(1)[0]
+        skel.parents[ii] = stack[-1][0] if stack else -1
+        if stack: stack[-1][1] -= 1
+        if numchildren: stack.append([ii, numchildren])
+        while stack and stack[-1][1] == 0: stack.pop()
+    skin.skel = skel
+
+
+def CacheSkinMeshes(file):
+    # generator over the mesh objects following the skeleton : the file is
+    # read sequentially, nothing else may move it in between
+    with perf.phase('parse'):
+        numgeom = read_long(file)
+    for ii in range(numgeom):
+        with perf.phase('parse'):
+            geom = CacheSkinMesh(file)
+        yield geom
+        geom = None
+
+
+def CacheSkinMesh(file):
+    geom = MeshIn(numchannels=1)
+    geom.meshname = readString(file)
+    # materials
+    readString(file) # dead
+    readString(file) # dead
+    geom.normalmap = readString(file)
+    for iii in range(read_long(file)):
+        colormap = os.path.basename(readString(file)).split('.', 1)[0]
+        lightmap = ''
+        offset   = read_long(file)
+        size     = read_long(file)
+        mat = Material(offset, size,
+            colormap, UV(0, 0), UV(1, 1),
+            lightmap, UV(0, 0), UV(1, 1),
+            '', UV(0, 0), UV(1, 1),
+            '', UV(0, 0), UV(1, 1),
+        )
+        geom.mat.append(mat)
+    # faces
+    numFaces = int(read_long(file)/3)
+    geom.faces = np.frombuffer(file.read(numFaces*6), dtype='<u2').reshape(-1,3).astype(np.uint32)
+    read_triangle_strip(file,geom)
+    # vertices : x,z,-y, nx,nz,-ny, u,v
+    numVerts = read_long(file)
+    data = np.frombuffer(file.read(numVerts*32), dtype='<f4').reshape(-1,8)
+    geom.co = pk2bl(data[:,0:3])
+    geom.normals = pk2bl(data[:,3:6])
+    geom.uv0 = flipv(data[:,6:8])
+    geom.uv1 = np.zeros((numVerts,2), dtype=np.float32)
+    file.seek(read_long(file)*3*SZ_FLOAT, io.SEEK_CUR)
+    file.seek(read_long(file)*8*SZ_FLOAT, io.SEEK_CUR)
+    # skinning : per vertex a count, then (bone, weight) pairs
+    numVerts = read_long(file)
+    counts = np.empty(numVerts, dtype=np.int32)
+    chunks = []
+    for iii in range(numVerts):
+        counts[iii] = count = read_long(file)
+        chunks.append(file.read(count*6))
+    pairs = np.frombuffer(b''.join(chunks), dtype=[('bone_idx','<u2'),('weight','<f4')])
+    geom.weights = SimpleNamespace(counts=counts, bone_idx=pairs['bone_idx'].astype(np.uint16), weight=pairs['weight'].astype(np.float32))
+    return geom
+
+
 def BuildSkeleton(skin):
     armature = bpy.data.armatures.new(skin.skinname+'_Armature')
     armature.display_type = 'ENVELOPE' # 'OCTAHEDRAL' 'STICK' 'BBONE' 'ENVELOPE' 'WIRE'
@@ -111,23 +139,25 @@ def BuildSkeleton(skin):
     bpy.context.view_layer.objects.active = arm_obj
     bpy.ops.object.mode_set(mode='EDIT')
 
+    # parent to world in a single pass (parents precede their children)
+    skel = skin.skel
+    world = skel.tms.astype(np.float64)
+    for i,parent in enumerate(skel.parents):
+        if parent != -1: world[i] = world[i] @ world[parent]
+    # pk to blender
+    pk = np.array(pkspc)
+    world = pk @ world.transpose(0,2,1) @ pk.T
+
     bones = []
-    names = []
-    for bone in skin.skel:
-        edit_bone = armature.edit_bones.new(bone.name)
+    for i,name in enumerate(skel.names):
+        edit_bone = armature.edit_bones.new(name)
         edit_bone.head = (0,0,0)
         edit_bone.tail = (0,1,0)
-        mtx = bone.tm
-        if bone.parent != -1:
-            edit_bone.parent = bones[bone.parent]
-            parent = bone.parent
-            while parent != -1:
-                mtx = mtx @ skin.skel[parent].tm
-                parent = skin.skel[parent].parent
-        mtx = pkspc @ mtx.transposed() @ pkspc.transposed()
-        edit_bone.matrix = mtx
+        if skel.parents[i] != -1:
+            edit_bone.parent = bones[skel.parents[i]]
+        edit_bone.matrix = mathutils.Matrix(world[i].tolist())
         bones.append(edit_bone)
-        names.append(edit_bone.name)
+    names = [bone.name for bone in bones]
 
     bpy.ops.object.mode_set(mode='OBJECT')
     return arm_obj, names
@@ -136,27 +166,51 @@ def BuildSkeleton(skin):
 def SetWeights(arm_obj, names, mesh_obj, weights):
     mod = mesh_obj.modifiers.new(name='Weights', type='ARMATURE')
     mod.object = arm_obj
-    vertex_groups = {}
-    for v,influences in enumerate(weights):
-        for influence in influences:
-            bone_name = names[influence.bone_idx]
-            if bone_name not in mesh_obj.vertex_groups:
-                vertex_groups[bone_name] = mesh_obj.vertex_groups.new(name=bone_name)
-            vertex_groups[bone_name].add([v], influence.weight, 'ADD')
-
-
-def load_mdl(file):
-    pkmdl = CachePKMDL(file)
-    mtl_cache = {}
-    image_cache = {}
-    for skin in pkmdl:
-        arm_obj, names = BuildSkeleton(skin)
-        for geom in skin.geometry:
-            mesh_obj = BuildMesh(geom)
-            SetWeights(arm_obj, names, mesh_obj, geom.weights)
-        # PKMDL is a collection of skinned rigs
-        # we only run against the first element
-        break
+    # sum the influences per bone and vertex
+    verts = np.repeat(np.arange(len(weights.counts)), weights.counts)
+    key = weights.bone_idx.astype(np.int64) * len(weights.counts) + verts
+    key, first, inverse = np.unique(key, return_index=True, return_inverse=True)
+    summed = np.bincount(inverse, weights.weight.astype(np.float64))
+    bone_of, vert_of = weights.bone_idx[first], verts[first] # sorted by bone
+    # one 'add' per distinct weight of a bone, bones in order of first use
+    bones, firstuse = np.unique(weights.bone_idx, return_index=True)
+    for bone_idx in bones[np.argsort(firstuse)]:
+        run = slice(np.searchsorted(bone_of, bone_idx), np.searchsorted(bone_of, bone_idx, side='right'))
+        vertex_group = mesh_obj.vertex_groups.new(name=names[bone_idx])
+        values, batch = np.unique(summed[run], return_inverse=True)
+        indices = vert_of[run]
+        for i,weight in enumerate(values):
+            vertex_group.add(indices[batch == i].tolist(), float(weight), 'REPLACE')
+
+
+def load_mdl(file, skinnames='', budget=0):
+    # PKMDL is a collection of skinned rigs
+    # '' : the first one, '*' : all, else comma separated names
+    index = IndexPKMDL(file)
+    if skinnames.strip() == '*':
+        wanted = [skin.skinname for skin in index]
+    elif skinnames.strip():
+        wanted = [name.strip() for name in skinnames.split(',') if name.strip()]
+    else:
+        wanted = [skin.skinname for skin in index[:1]]
+    imported = []
+    for skin in index:
+        if skin.skinname not in wanted: continue
+        imported.append(skin.skinname)
+        with perf.phase('parse'):
+            CacheSkeleton(file, skin)
+        with perf.phase('skeleton'):
+            arm_obj, names = BuildSkeleton(skin)
+        # one mesh object at a time : decode (on a background thread, a few
+        # objects ahead), build, drop
+        for geom in prefetch(CacheSkinMeshes(file), budget):
+            with perf.phase('build'):
+                mesh_obj = BuildMesh(geom)
+            with perf.phase('weights'):
+                SetWeights(arm_obj, names, mesh_obj, geom.weights)
+            geom = None # built, release
+    # imported, requested but missing
+    return imported, [name for name in wanted if name not in [skin.skinname for skin in index]]
 
 
 def CacheAnim(file):
@@ -173,46 +227,127 @@ def CacheAnim(file):
             m=mathutils.Matrix((data[0:4],data[4:8],data[8:12],data[12:16]))
             bone.keys.append(SimpleNamespace(timestamp=timestamp,tm=m))
         anim.bones.append(bone)
+    # reduced keys : resample every bone to the full frame rate
+    counts = [bone.numframes for bone in anim.bones]
+    if len(set(counts)) > 1:
+        numframes = max(counts)
+        last = anim.bones[counts.index(numframes)].keys[-1].timestamp
+        if duration > last: numframes = max(numframes, int(round(duration / (duration - last))))
+        times = [i * duration / numframes for i in range(numframes)]
+        for bone in anim.bones:
+            if bone.numframes != numframes:
+                bone.keys = SampleKeys(bone.keys, times)
+                bone.numframes = numframes
     return anim
 
 
-def load_ani(file, context, bUseScale = False, bCloseLoop = False):
-    anim = CacheAnim(file)
+def SampleKeys(keys, times):
+    # interpolate the keys at the given timestamps
+    stamps = [key.timestamp for key in keys]
+    comps = [key.tm.transposed().decompose() for key in keys]
+    samples = []
+    for t in times:
+        k = max(0, min(bisect.bisect_right(stamps, t) - 1, len(keys) - 2))
+        if len(keys) == 1:
+            samples.append(SimpleNamespace(timestamp=t,tm=keys[0].tm.copy()))
+            continue
+        span = stamps[k+1] - stamps[k]
+        f = min(max((t - stamps[k]) / span, 0.0), 1.0) if span > 0 else 0.0
+        (l0,r0,s0),(l1,r1,s1) = comps[k],comps[k+1]
+        m = mathutils.Matrix.LocRotScale(l0.lerp(l1,f), r0.slerp(r1,f), s0.lerp(s1,f))
+        samples.append(SimpleNamespace(timestamp=t,tm=m.transposed()))
+    return samples
 
-    try: arm_obj=[obj for obj in context.scene.objects if obj.type == 'ARMATURE'][0]
-    except: return
 
-    action_name = os.path.splitext(os.path.basename(file.name))[0]
+def KeyFrames(values, tol):
+    # frames to key so that linear interpolation rebuilds 'values' (frames x components) within 'tol'
+    numframes = len(values)
+    frames = np.arange(numframes)
+    keep = np.zeros(numframes, dtype=bool)
+    keep[[0,-1]] = True
+    # corners : frames off the line through their neighbours
+    if numframes > 2:
+        keep[1:-1] = np.abs(values[:-2] - 2*values[1:-1] + values[2:]).max(axis=1) > tol
+    while True:
+        idx = np.flatnonzero(keep)
+        approx = np.stack([np.interp(frames, idx, values[idx,c]) for c in range(values.shape[1])], axis=1)
+        err = np.abs(approx - values).max(axis=1)
+        bad = np.flatnonzero(err > tol)
+        if not len(bad): return idx
+        # split every run that drifts off at its worst frame
+        run = np.searchsorted(idx, bad)
+        order = np.lexsort((-err[bad], run))
+        _, first = np.unique(run[order], return_index=True)
+        keep[bad[order][first]] = True
+
+
+def InsertReducedKeys(arm_obj, BASIS, tol):
+    # linear keys straight into the fcurves (keyframe_insert keys are bezier,
+    # whatever the preferences say), then every frame played back is checked
+    # against the full clip : frames still off by more than 'tol' get a key
+    action_fcurves = ActionFCurves(arm_obj)
+    for name,keys in BASIS.items():
+        pose_bone = arm_obj.pose.bones[name]
+        loc = np.empty((len(keys),3)); rot = np.empty((len(keys),4)); scl = np.empty((len(keys),3))
+        for i,matrix_basis in enumerate(keys):
+            loc[i],rot[i],scl[i] = matrix_basis.decompose()
+        # keep quaternions in one hemisphere
+        dots = np.einsum('ij,ij->i', rot[1:], rot[:-1])
+        rot[1:] *= np.cumprod(np.where(dots < 0, -1.0, 1.0))[:,None]
+        for path,values in (('location',loc),('rotation_quaternion',rot),('scale',scl)):
+            data_path = pose_bone.path_from_id(path)
+            fcurves = [EnsureFCurve(action_fcurves, data_path, c, name) for c in range(values.shape[1])]
+            keyed = np.zeros(len(values), dtype=bool)
+            frames = KeyFrames(values, tol)
+            while len(frames):
+                for c,fcurve in enumerate(fcurves):
+                    for i in frames.tolist():
+                        kp = fcurve.keyframe_points.insert(i, values[i,c], options={'FAST'})
+                        kp.interpolation = 'LINEAR'
+                    fcurve.update()
+                keyed[frames] = True
+                played = np.array([[fcurve.evaluate(i) for fcurve in fcurves] for i in range(len(values))])
+                frames = np.flatnonzero((np.abs(played - values).max(axis=1) > tol) & ~keyed)
+
+
+def AnimRig(arm_obj):
+    # hierarchy & rest matrices shared by every clip
+    rig = SimpleNamespace(arm_obj=arm_obj, parents={}, to_rest={})
+    for pose_bone in arm_obj.pose.bones:
+        to_rest = pose_bone.bone.matrix_local.inverted()
+        if pose_bone.parent: to_rest = to_rest @ pose_bone.parent.bone.matrix_local
+        rig.parents[pose_bone.name] = pose_bone.parent.name if pose_bone.parent else None
+        rig.to_rest[pose_bone.name] = to_rest
+    return rig
+
+
+def BuildAction(rig, anim, action_name, bUseScale = False, bCloseLoop = False, reduce = None):
+    arm_obj = rig.arm_obj
     action = bpy.data.actions.new(name=action_name)
     if not arm_obj.animation_data:
         arm_obj.animation_data_create()
     arm_obj.animation_data.action = action
 
-    numframes = anim.bones[0].numframes + int(bCloseLoop)
-    context.scene.frame_end = numframes
-    context.scene.render.fps_base = 1
-    context.scene.render.fps = int(round(numframes/anim.duration))
+    ANIM = {}
+    for bone in anim.bones: ANIM.setdefault(bone.name, bone)
 
     BONES = {}
+    BASIS = {}
     for bone in anim.bones:
         try: pose_bone = arm_obj.pose.bones[bone.name]
         except: continue
         BONES[pose_bone.name]=[]
+        BASIS[pose_bone.name]=[]
         if bCloseLoop: bone.keys.append(bone.keys[0])
         for i,key in enumerate(bone.keys):
             if not bUseScale:
                 mtx = key.tm
                 try:
                     # parent to world
-                    pbone = arm_obj.pose.bones[bone.name]
-                    run = True
-                    while run and pbone.parent:
-                        for j,_bone in enumerate(anim.bones):
-                            if pbone.parent and _bone.name == pbone.parent.name:
-                                mtx = mtx @ _bone.keys[i].tm
-                                pbone = arm_obj.pose.bones[_bone.name]
-                                break
-                            if j == len(anim.bones)-1: run = False
+                    parent = rig.parents[pose_bone.name]
+                    while parent in ANIM:
+                        mtx = mtx @ ANIM[parent].keys[i].tm
+                        parent = rig.parents[parent]
                     # pk to blender
                     mtx = pkspc @ mtx.transposed() @ pkspc.transposed()
                     # !!! REMOVE SCALING !!!
@@ -228,13 +363,78 @@ def load_ani(file, context, bUseScale = False, bCloseLoop = False):
             else:
                 mtx = pkspc @ key.tm.transposed() @ pkspc.transposed()
             # parent to rest ('matrix_basis' is identity in a rest pose)
-            if pose_bone.parent:
-                matrix_basis = pose_bone.bone.matrix_local.inverted() @ \
-                pose_bone.parent.bone.matrix_local @ mtx
-            else:
-                matrix_basis = pose_bone.bone.matrix_local.inverted() @ mtx
+            matrix_basis = rig.to_rest[pose_bone.name] @ mtx
+            if reduce is not None:
+                BASIS[pose_bone.name].append(matrix_basis)
+                continue
             # apply transform
             pose_bone.matrix_basis = matrix_basis
             pose_bone.keyframe_insert(data_path='location',           frame=i)
             pose_bone.keyframe_insert(data_path='rotation_quaternion',frame=i)
-            pose_bone.keyframe_insert(data_path='scale',              frame=i)
\ No newline at end of file
+            pose_bone.keyframe_insert(data_path='scale',              frame=i)
+
+    # only the keys linear interpolation can't rebuild
+    if reduce is not None: InsertReducedKeys(arm_obj, BASIS, reduce)
+    return action
+
+
+def load_ani(file, context, bUseScale = False, bCloseLoop = False, reduce = None):
+    with perf.phase('parse'):
+        anim = CacheAnim(file)
+
+    try: arm_obj=[obj for obj in context.scene.objects if obj.type == 'ARMATURE'][0]
+    except: return
+
+    numframes = anim.bones[0].numframes + int(bCloseLoop)
+    context.scene.frame_end = numframes
+    context.scene.render.fps_base = 1
+    context.scene.render.fps = int(round(numframes/anim.duration))
+
+    action_name = os.path.splitext(os.path.basename(file.name))[0]
+    with perf.phase('keys'):
+        BuildAction(AnimRig(arm_obj), anim, action_name, bUseScale, bCloseLoop, reduce)
+
+
+def load_anis(filepaths, context, bUseScale = False, bCloseLoop = False, reduce = None, budget = 0):
+    try: arm_obj=[obj for obj in context.scene.objects if obj.type == 'ARMATURE'][0]
+    except: return
+
+    rig = AnimRig(arm_obj)
+
+    # decode the clips off the main thread, at most budget bytes of clips ahead
+    def decode(filepath):
+        with open(filepath, 'rb') as file: return CacheAnim(file)
+    anims = decode_ahead(decode, filepaths, [os.path.getsize(f) for f in filepaths], budget)
+
+    if not arm_obj.animation_data:
+        arm_obj.animation_data_create()
+    active = arm_obj.animation_data.action
+
+    # one action per clip, stashed as a muted NLA track. the scene takes the
+    # rate of the first clip, strips of clips at another rate are scaled to
+    # play at their own speed
+    numframes = 0
+    fps = None
+    retimed = []
+    for filepath,anim in zip(filepaths, anims):
+        action_name = os.path.splitext(os.path.basename(filepath))[0]
+        with perf.phase('keys'):
+            action = BuildAction(rig, anim, action_name, bUseScale, bCloseLoop, reduce)
+        track = arm_obj.animation_data.nla_tracks.new()
+        track.name = action.name
+        strip = track.strips.new(action.name, 0, action)
+        track.mute = True
+        clipframes = anim.bones[0].numframes + int(bCloseLoop)
+        rate = clipframes/anim.duration
+        if fps is None: fps = int(round(rate))
+        if int(round(rate)) != fps:
+            strip.scale = fps/rate
+            retimed.append(action.name)
+        numframes = max(numframes, int(round(clipframes*strip.scale)))
+    arm_obj.animation_data.action = active
+
+    context.scene.frame_end = numframes
+    context.scene.render.fps_base = 1
+    context.scene.render.fps = fps
+    # clips stretched to the scene's rate
+    return retimed
@@ -16,18 +16,14 @@ def dumpMPK(file, ob):
     # vertices
     write_long(file,ob.numUVs)
     write_long(file,len(ob.verts))
-    for key in ob.verts:
-        file.write(key[0:12])
-        if ob.numUVs == 2:
-            write_float(file,0)
-            file.write(key[24:40])
-        else:
-            file.write(key[12:32])
+    if ob.numUVs == 2:
+        file.write(packVerts(ob.verts, 'pos', None, 'uv0', 'uv1'))
+    else:
+        file.write(packVerts(ob.verts, 'pos', 'normal', 'uv0'))
     # normals if 2-ch
     if ob.numUVs == 2:
         write_long(file,len(ob.verts))
-        for key in ob.verts:
-            file.write(key[12:24])
+        file.write(ob.verts['normal'].tobytes())
     else:
         write_long(file,0)
 
@@ -36,10 +32,7 @@ def dumpMPK(file, ob):
 
     # faces
     write_long(file,len(ob.faces)*3)
-    for f in ob.faces:
-        write_short(file,f[0])
-        write_short(file,f[2])
-        write_short(file,f[1])
+    file.write(ob.faces[:,[0,2,1]].astype('<u2').tobytes())
 
     # materials
     mtl_offset = 0
@@ -47,8 +40,7 @@ def dumpMPK(file, ob):
     write_long(file,num_mtls)
     for i in range(num_mtls):
         write_short(file,mtl_offset)
-        mtl_len = ob.mtls.get(i)[0]
-        mtl_idx = ob.mtls.get(i)[1]
+        mtl_len, mtl_idx = ob.mtls[i].tolist()
         mtl = ob.materials[mtl_idx]
         mtl_offset += mtl_len * 3
         write_short(file,mtl_len)
@@ -80,11 +72,15 @@ def dumpMPK(file, ob):
 
 
 def save_mpk(file, context, global_matrix, params):
-    data = getGeometry(file, context, global_matrix, params)
+    writeMPK(file, getGeometry(file, context, global_matrix, params))
+
+
+def writeMPK(file, geom):
     offsets = []
-    for ob in data.geom:
+    for ob in geom:
         offsets.append(file.tell())
-        dumpMPK(file, ob)
+        with perf.phase('write'):
+            file.write(ObjectChunk(ob, dumpMPK).data)
     for offset in offsets:
         write_long(file, offset)
     write_long(file, len(offsets))
@@ -1,7 +1,16 @@
 from .common import *
 
 
-def load_mpk(file):
+def load_mpk(file, budget=0):
+    # decoding runs a few objects ahead of the build, on a background thread
+    for geom in prefetch(CacheMPK(file), budget):
+        with perf.phase('build'):
+            BuildMesh(geom)
+        geom = None # built, release
+
+
+def CacheMPK(file):
+    # generator : chunk table at the end, then one object per chunk
     file.seek(-8, io.SEEK_END)
     numobj = read_long(file)
 
@@ -11,12 +20,12 @@ def load_mpk(file):
     for i in range(numobj):
         addr.append(read_long(file))
 
-    mtl_cache = {}
-    image_cache = {}
     for i in range(numobj):
-        geom = MeshIn('', 0, 0, [], 0, [], 0, [], '', 0x02, 0, 0, 0)
-        CacheMeshMPK(file, addr[i], geom)
-        BuildMesh(geom)
+        geom = MeshIn()
+        with perf.phase('parse'):
+            CacheMeshMPK(file, addr[i], geom)
+        yield geom
+        geom = None
 
 
 def CacheMeshMPK(file, addr, geom):
@@ -29,60 +38,44 @@ def CacheMeshMPK(file, addr, geom):
 
     # vertices
     geom.numchannels = read_long(file)
-    geom.numVerts = read_long(file)
-
-    for i in range(geom.numVerts):
-        vert = Vertex(0, 0, 0, 0, 0, 0, 0, 0, 0, 0)
-        vert.x = read_float(file)
-        vert.z = read_float(file)
-        vert.y = -read_float(file)
-        if geom.numchannels == 2:
-            if magicBytes == 0xDEAFBABE:
-                file.seek(4, io.SEEK_CUR) # 0x0
-                vert.u = read_float(file)
-                vert.v = 1 - read_float(file)
-                vert.u2 = read_float(file)
-                vert.v2 = 1 - read_float(file)
-            else: # 0xDEADBABE
-                vert.u = read_float(file)
-                vert.v = 1 - read_float(file)
-                vert.u2 = read_float(file)
-                vert.v2 = 1 - read_float(file)
-                file.seek(24, io.SEEK_CUR) # tangents - ?
-                vert.nx = read_float(file)
-                vert.nz = read_float(file)
-                vert.ny = -read_float(file)
-        else:
-            vert.nx = read_float(file)
-            vert.nz = read_float(file)
-            vert.ny = -read_float(file)
-            vert.u = read_float(file)
-            vert.v = 1 - read_float(file)
-        geom.verts.append(vert)
+    numVerts = read_long(file)
+    if geom.numchannels == 2:
+        if magicBytes == 0xDEAFBABE:
+            # x,z,-y, 0x0, u,v, u2,v2
+            data = np.frombuffer(file.read(numVerts*32), dtype='<f4').reshape(-1,8)
+            co, uv0, uv1 = data[:,0:3], data[:,4:6], data[:,6:8]
+            normals = np.zeros((numVerts,3), dtype=np.float32)
+        else: # 0xDEADBABE
+            # x,z,-y, u,v, u2,v2, tangents - ?, nx,nz,-ny
+            data = np.frombuffer(file.read(numVerts*64), dtype='<f4').reshape(-1,16)
+            co, uv0, uv1, normals = data[:,0:3], data[:,3:5], data[:,5:7], data[:,13:16]
+    else:
+        # x,z,-y, nx,nz,-ny, u,v
+        data = np.frombuffer(file.read(numVerts*32), dtype='<f4').reshape(-1,8)
+        co, normals, uv0 = data[:,0:3], data[:,3:6], data[:,6:8]
+        uv1 = np.zeros((numVerts,2), dtype=np.float32)
+    geom.co = pk2bl(co)
+    geom.normals = pk2bl(normals)
+    geom.uv0 = flipv(uv0)
+    geom.uv1 = flipv(uv1) if geom.numchannels == 2 else uv1
 
     # normals if 2-ch
     nrmls = read_long(file)
-    for i in range(nrmls):
-        geom.verts[i].nx = read_float(file)
-        geom.verts[i].nz = read_float(file)
-        geom.verts[i].ny = -read_float(file)
+    if nrmls:
+        data = np.frombuffer(file.read(nrmls*12), dtype='<f4').reshape(-1,3)
+        geom.normals[:nrmls] = pk2bl(data)
 
     # skip bounding box
     file.seek(24, io.SEEK_CUR)
 
-    # faces
-    geom.numFaces = int(read_long(file) / 3)
-    for i in range(geom.numFaces):
-        face = Face(0, 0, 0)
-        face.v0 = read_short(file)
-        face.v2 = read_short(file)
-        face.v1 = read_short(file)
-        geom.faces.append(face)
+    # faces : v0,v2,v1
+    numFaces = int(read_long(file) / 3)
+    faces = np.frombuffer(file.read(numFaces*6), dtype='<u2').reshape(-1,3)
+    geom.faces = faces[:,[0,2,1]].astype(np.uint32)
 
     if magicBytes != 0xDEAFBABE and geom.numchannels == 2: file.seek(4, io.SEEK_CUR) # - ?
     # materials
-    geom.nummat = read_long(file)
-    for i in range(geom.nummat):
+    for i in range(read_long(file)):
         mat = Material(
             read_short(file),
             read_short(file),
@@ -0,0 +1,205 @@
+import cProfile
+import io
+import json
+import os
+import pstats
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+
+# nested phase timers & counters for the importers/exporters
+#
+#   perf.begin('MPK import')
+#   with perf.phase('parse'): ...
+#   perf.count('verts', n, ob=name)
+#   report = perf.end()
+#
+# 'perf.last' keeps the report of the last import/export for Python callers,
+# the operators' 'Timing report' option writes it as JSON next to the file
+# (PK2004_PERF_REPORT, a file or directory, overrides where or turns it on).
+#
+# perf.begin(name, profile=True) or PK2004_PROFILE (1, a .prof file or a
+# directory) also runs cProfile, one profiler per top-level phase of the
+# calling thread, and writes the merged .prof plus a top-N cumulative listing
+# per phase (.txt).
+
+
+last = None     # last finished report
+top = 30        # functions listed per phase in the profile summary
+_report = None  # report being recorded
+_local = threading.local()
+
+
+class Phase:
+    __slots__ = ('name', 'calls', 'time', 'children')
+
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.time = 0.0
+        self.children = {}
+
+    def as_dict(self):
+        return {
+            'name': self.name,
+            'calls': self.calls,
+            'time': round(self.time, 6),
+            'children': [child.as_dict() for child in self.children.values()],
+        }
+
+
+class Report:
+
+    def __init__(self, name):
+        self.name = name
+        self.root = Phase(name)
+        self.counters = {}
+        self.objects = {}
+        self.lock = threading.Lock()
+        self.thread = threading.get_ident()
+        self.profiles = None  # {top-level phase: cProfile.Profile}
+        self.active = None
+        self.start = time.perf_counter()
+
+    def as_dict(self):
+        return {
+            'name': self.name,
+            'time': round(self.root.time, 6),
+            'phases': [child.as_dict() for child in self.root.children.values()],
+            'counters': dict(self.counters),
+            'objects': {name: dict(counters) for name, counters in self.objects.items()},
+        }
+
+    def summary(self):
+        lines = [f'{self.name}: {self.root.time:.2f}s']
+        def walk(phase, depth):
+            for child in phase.children.values():
+                share = 100 * child.time / self.root.time if self.root.time else 0
+                lines.append(f'{"  "*depth}{child.name:<{28-2*depth}} {child.time:8.3f}s {share:5.1f}%  x{child.calls}')
+                walk(child, depth + 1)
+        walk(self.root, 1)
+        for key, value in self.counters.items():
+            lines.append(f'  {key:<26} {value}')
+        return '\n'.join(lines)
+
+    def dump(self, filepath):
+        with open(filepath, 'w') as file:
+            json.dump(self.as_dict(), file, indent=1)
+
+    def profile(self, name):
+        # switch to the profiler of a top-level phase, None stops profiling
+        if self.active: self.active.disable()
+        self.active = None
+        if name is None: return
+        prof = self.profiles.get(name)
+        if prof is None: prof = self.profiles[name] = cProfile.Profile()
+        self.active = prof
+        prof.enable()
+
+    def dump_profile(self, filepath):
+        profiles = {name: prof for name, prof in self.profiles.items() if prof.getstats()}
+        if not profiles: return
+        pstats.Stats(*profiles.values()).dump_stats(filepath)
+        with open(os.path.splitext(filepath)[0] + '.txt', 'w') as file:
+            for name, prof in profiles.items():
+                stream = io.StringIO()
+                pstats.Stats(prof, stream=stream).sort_stats('cumulative').print_stats(top)
+                file.write(f'=== {self.name} / {name} ===\n{stream.getvalue()}\n')
+
+
+def _stack():
+    stack = getattr(_local, 'stack', None)
+    if stack is None: stack = _local.stack = []
+    return stack
+
+
+def begin(name, profile=False):
+    global _report
+    _report = Report(name)
+    _local.stack = []
+    if profile or _profile_env() is not None:
+        _report.profiles = {}
+        _report.profile('(other)')
+    return _report
+
+
+def end():
+    global _report, last
+    report = _report
+    if report is None: return None
+    if report.profiles is not None: report.profile(None)
+    report.root.calls = 1
+    report.root.time = time.perf_counter() - report.start
+    _report = None
+    last = report
+    return report
+
+
+@contextmanager
+def phase(name):
+    report = _report
+    if report is None:
+        yield
+        return
+    stack = _stack()
+    parent = stack[-1] if stack else report.root
+    with report.lock:
+        node = parent.children.get(name)
+        if node is None: node = parent.children[name] = Phase(name)
+    profile = report.profiles is not None and not stack and threading.get_ident() == report.thread
+    if profile: report.profile(name)
+    stack.append(node)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        stack.pop()
+        if profile: report.profile('(other)')
+        with report.lock:
+            node.calls += 1
+            node.time += elapsed
+
+
+def count(key, n=1, ob=None):
+    report = _report
+    if report is None: return
+    with report.lock:
+        report.counters[key] = report.counters.get(key, 0) + n
+        if ob is not None:
+            counters = report.objects.setdefault(ob, {})
+            counters[key] = counters.get(key, 0) + n
+
+
+def _profile_env():
+    # PK2004_PROFILE : a flag ('1', 'yes' ...) turns profiling on, a directory
+    # or a '.prof' path also says where it goes ; unset, '0', 'no', 'off' : off
+    value = os.environ.get('PK2004_PROFILE', '').strip()
+    if value.lower() in ('', '0', 'no', 'off', 'false'): return None
+    return value if os.path.isdir(value) or value.endswith('.prof') else ''
+
+
+def _target(env, filepath, ext, default=None):
+    target = os.environ.get(env) or default
+    if target and os.path.isdir(target):
+        target = os.path.join(target, os.path.basename(filepath) + ext)
+    return target
+
+
+def emit(report, filepath, json_report=False):
+    # console summary, plus JSON if asked for (next to 'filepath') or if
+    # PK2004_PERF_REPORT is set
+    if report is None: return
+    print(report.summary())
+    beside = os.path.dirname(os.path.abspath(filepath)) if json_report else None
+    target = _target('PK2004_PERF_REPORT', filepath, '.perf.json', beside)
+    if target:
+        report.dump(target)
+        print(f'timing report written to {target}')
+    if report.profiles is not None:
+        target = _profile_env() or tempfile.gettempdir()
+        if os.path.isdir(target): target = os.path.join(target, os.path.basename(filepath) + '.prof')
+        report.dump_profile(target)
+        print(f'profile written to {target}')
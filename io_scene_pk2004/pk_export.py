@@ -5,9 +5,14 @@ from .mpkexp import save_mpk
 from .datexp import save_dat
 from .mdlexp import save_mdl
 from .mdlexp import save_ani
+from .mdlexp import save_anis
 
 
-def load(operator, context, filepath='', use_default=True, use_optimize=False, use_all=True, use_selection=False, use_visible=False, use_sort=False, scale_factor=1.0, global_matrix=None):
+bProfile = False
+bReport = False
+
+
+def load(operator, context, filepath='', use_default=True, use_optimize=False, use_all=True, use_selection=False, use_visible=False, use_sort=False, scale_factor=1.0, max_influences=4, weight_epsilon=0.001, use_reduce_keys=False, key_pos_tolerance=0.001, key_rot_tolerance=0.001745, use_all_actions=False, use_cache=True, use_cache_dir=False, use_perf_report=False, use_profile=False, global_matrix=None):
     
     global filetype; filetype = Path(filepath).suffix.split('.')[-1].upper()
 
@@ -18,6 +23,19 @@ def load(operator, context, filepath='', use_default=True, use_optimize=False, u
     global bVisible;   bVisible   = use_visible
     global bSort;      bSort      = use_sort
     global scale;      scale      = scale_factor
+    global limits;     limits     = (max_influences, weight_epsilon)
+    global reduce;     reduce     = (None,(key_pos_tolerance, key_rot_tolerance))[use_reduce_keys]
+    global bProfile;   bProfile   = use_profile
+    global bReport;    bReport    = use_perf_report
+
+    # unchanged objects are copied from the chunk cache of this session (and
+    # of earlier ones, kept next to the .blend)
+    chunks.enabled = use_cache
+    chunks.path = (None, ChunkPath())[use_cache and use_cache_dir]
+
+    if filetype == 'ANI' and use_all_actions:
+        save_data_batch(filepath, context)
+        return {'FINISHED'}
 
     save_data(filepath, context, global_matrix)
 
@@ -35,14 +53,15 @@ def save_data(filepath, context, global_matrix):
 
     duration = time.time()
     context.window.cursor_set('WAIT')
+    perf.begin(f'{filetype} export', bProfile)
 
     try:
         params = (filetype, bOptimize, bAll, bSelection, bVisible, bSort, scale)
         match filetype:
             case 'MPK'  : save_mpk(file, context, global_matrix, params)
             case 'DAT'  : save_dat(file, context, global_matrix, params)
-            case 'PKMDL': save_mdl(file, context, global_matrix, params)
-            case 'ANI'  : save_ani(file, context)
+            case 'PKMDL': save_mdl(file, context, global_matrix, params, limits)
+            case 'ANI'  : save_ani(file, context, reduce)
         info('success', icon='INFO')
     except:
         info('something went wrong', icon='ERROR')
@@ -50,4 +69,26 @@ def save_data(filepath, context, global_matrix):
     file.close()
 
     context.window.cursor_set('DEFAULT')
+    perf.emit(perf.end(), filepath, bReport)
+    print(f'{filetype} export time: %.2f' % (time.time() - duration))
+
+
+def save_data_batch(filepath, context):
+
+    dirname = os.path.dirname(filepath)
+
+    print(f'exporting all actions to {filetype}: %r...' % dirname)
+
+    duration = time.time()
+    context.window.cursor_set('WAIT')
+    perf.begin(f'{filetype} export', bProfile)
+
+    try:
+        count = save_anis(dirname, context, reduce)
+        info(f'{count} actions exported', icon='INFO')
+    except:
+        info('something went wrong', icon='ERROR')
+
+    context.window.cursor_set('DEFAULT')
+    perf.emit(perf.end(), dirname, bReport)
     print(f'{filetype} export time: %.2f' % (time.time() - duration))
@@ -5,9 +5,14 @@ from .mpkimp import load_mpk
 from .datimp import load_dat
 from .mdlimp import load_mdl
 from .mdlimp import load_ani
+from .mdlimp import load_anis
 
 
-def load(operator, context, filepath='', use_lightmaps=True, use_blendmaps=True, remove_doubles=True, use_scale=False, close_seq=False):
+bProfile = False
+bReport = False
+
+
+def load(operator, context, filepath='', use_lightmaps=True, use_blendmaps=True, remove_doubles=True, use_scale=False, close_seq=False, use_reduce_keys=False, key_tolerance=0.0001, skin_names='', files=None, directory='', memory_limit=0, use_perf_report=False, use_profile=False):
 
     global filetype; filetype = Path(filepath).suffix.split('.')[-1].upper()
 
@@ -15,12 +20,29 @@ def load(operator, context, filepath='', use_lightmaps=True, use_blendmaps=True,
 
     def info(msg='', icon='INFO'): operator.report({icon}, f'{filetype} Import : {msg}')
 
-    load_data(filepath, context, use_lightmaps, use_blendmaps, remove_doubles, use_scale, close_seq)
+    reduce = (None,key_tolerance)[use_reduce_keys]
+
+    global bProfile; bProfile = use_profile
+    global bReport;  bReport  = use_perf_report
+
+    global budget; budget = memory_limit * 1024 * 1024
+
+    # several clips or a whole directory of clips
+    if os.path.isdir(filepath):
+        filepaths = sorted(str(p) for p in Path(filepath).iterdir() if p.suffix.lower() == '.ani')
+    else:
+        filepaths = [os.path.join(directory, f.name) for f in files or () if Path(f.name).suffix.lower() == '.ani']
+    if len(filepaths) > 1 or os.path.isdir(filepath):
+        filetype = 'ANI'
+        load_data_batch(filepaths, context, use_scale, close_seq, reduce)
+        return {'FINISHED'}
+
+    load_data(filepath, context, use_lightmaps, use_blendmaps, remove_doubles, use_scale, close_seq, reduce, skin_names)
 
     return {'FINISHED'}
 
 
-def load_data(filepath, context, use_lightmaps, use_blendmaps, remove_doubles, use_scale, close_seq):
+def load_data(filepath, context, use_lightmaps, use_blendmaps, remove_doubles, use_scale, close_seq, reduce=None, skin_names=''):
 
     if bpy.ops.object.select_all.poll():
         bpy.ops.object.select_all(action='DESELECT')
@@ -69,22 +91,31 @@ def load_data(filepath, context, use_lightmaps, use_blendmaps, remove_doubles, u
 
     duration = time.time()
     context.window.cursor_set('WAIT')
+    perf.begin(f'{filetype} import', bProfile)
     
+    bSuccess = True
     try:
         match filetype:
-            case 'MPK'  : load_mpk(file)
-            case 'DAT'  : load_dat(file)
-            case 'PKMDL': load_mdl(file)
-            case 'ANI'  : load_ani(file, context, use_scale, close_seq)
-        try:
-            for ob in bpy.data.collections['___zone___'].all_objects:
-                ob.select_set(True)
-            bpy.ops.object.shade_flat()
-            bpy.ops.object.select_all(action='DESELECT')
-        except: pass        
-        if bRemoveDoubles: RemoveDoubles()
+            case 'MPK'  : load_mpk(file, budget)
+            case 'DAT'  : load_dat(file, budget)
+            case 'PKMDL':
+                imported, missing = load_mdl(file, skin_names, budget)
+                if not imported:
+                    info(('no skins in the file', 'skins not found : ' + ', '.join(missing))[bool(missing)], icon='ERROR')
+                    bSuccess = False
+                elif missing: info('skins not found : ' + ', '.join(missing), icon='WARNING')
+            case 'ANI'  : load_ani(file, context, use_scale, close_seq, reduce)
+        with perf.phase('shade_flat'):
+            try:
+                for ob in bpy.data.collections['___zone___'].all_objects:
+                    ob.select_set(True)
+                bpy.ops.object.shade_flat()
+                bpy.ops.object.select_all(action='DESELECT')
+            except: pass        
+        if bRemoveDoubles:
+            with perf.phase('remove_doubles'): RemoveDoubles()
         
-        info('success', icon='INFO')
+        if bSuccess: info('success', icon='INFO')
     except:
         info('something went wrong', icon='ERROR')
 
@@ -97,4 +128,29 @@ def load_data(filepath, context, use_lightmaps, use_blendmaps, remove_doubles, u
     except: pass
 
     context.window.cursor_set('DEFAULT')
+    perf.emit(perf.end(), filepath, bReport)
+    print(f'{filetype} import time: %.2f' % (time.time() - duration))
+
+
+def load_data_batch(filepaths, context, use_scale, close_seq, reduce=None):
+
+    if not filepaths:
+        info('no clips found', icon='ERROR')
+        return
+
+    print(f'importing {len(filepaths)} {filetype} clips...')
+
+    duration = time.time()
+    context.window.cursor_set('WAIT')
+    perf.begin(f'{filetype} import', bProfile)
+
+    try:
+        retimed = load_anis(filepaths, context, use_scale, close_seq, reduce, budget)
+        if retimed: info(f'clips at another frame rate, strips scaled to {context.scene.render.fps} fps : ' + ', '.join(retimed), icon='WARNING')
+        info(f'{len(filepaths)} clips imported', icon='INFO')
+    except:
+        info('something went wrong', icon='ERROR')
+
+    context.window.cursor_set('DEFAULT')
+    perf.emit(perf.end(), os.path.dirname(filepaths[0]), bReport)
     print(f'{filetype} import time: %.2f' % (time.time() - duration))